@@ -4,25 +4,46 @@ Production FastAPI server for Grooved Learning Fulfillment.
 
 Follows proven patterns from og-phonics and science-reading-rag projects.
 """
+import asyncio
 import logging
+import queue
+import time
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List
 
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
-from fastapi.responses import JSONResponse
+import httpx
+import orjson
+import redis.asyncio as redis
+from cachetools import LRUCache
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from pydantic import ValidationError
 
+from fulfillment.utils import metrics
 from fulfillment.utils.config import Settings
 from fulfillment.shopify.webhook_handler import ShopifyWebhookHandler, ShopifyOrder
 from fulfillment.shopify.client import ShopifyClient
-from fulfillment.shippo.client import ShippoService, ShippoAddress, ShippoParcel, ShippoOrder
+from fulfillment.shippo.client import ShippoService, ShippoAddress, ShippoParcel, ShippoLabelResponse
 
-# Configure logging following our patterns
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Configure logging following our patterns. Handlers only enqueue records;
+# a listener thread formats and writes them so log I/O never blocks the loop
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 )
+log_listener = QueueListener(log_queue, log_stream_handler, respect_handler_level=True)
+# The QueueHandler gets no formatter: prepare() would otherwise render the
+# message once here and the stream handler would format it a second time.
+# It is attached in lifespan alongside the listener, not at import, so a
+# module imported twice still feeds exactly one drained queue
+log_queue_handler = QueueHandler(log_queue)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize settings
@@ -33,25 +54,164 @@ project_root = Path(__file__).parent.parent
 ORDERS_DIR = project_root / "data" / "orders"
 ORDERS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Static response bodies for the hot webhook paths
+DUPLICATE_RESPONSE = {
+    "status": "duplicate",
+    "message": "Webhook already received"
+}
+
+# Shippo provider token -> Shopify tracking company name
+SHOPIFY_CARRIER_NAMES = {
+    "usps": "USPS",
+    "ups": "UPS",
+    "fedex": "FedEx",
+    "dhl_express": "DHL Express",
+}
+
+# Parsed order/fulfillment files, revalidated against the file's mtime
+_json_file_cache: LRUCache = LRUCache(maxsize=1024)
+
+
+def read_json_file(path: Path) -> Dict[str, Any]:
+    """Load a stored JSON file, reusing the parsed copy until the file changes."""
+    mtime = path.stat().st_mtime_ns
+    cached = _json_file_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, orjson.loads(path.read_bytes()))
+        _json_file_cache[path] = cached
+    # Shallow copy so callers can add keys without touching the cache
+    return dict(cached[1])
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle - startup and shutdown."""
     # Startup
+    root_logger.addHandler(log_queue_handler)
+    log_listener.start()
     logger.info("Starting up fulfillment service...")
     app.state.settings = settings
-    app.state.webhook_handler = ShopifyWebhookHandler(settings)
+    
+    # One pooled client for all outbound calls so Shopify and Shippo
+    # requests reuse keep-alive connections instead of handshaking per call;
+    # with HTTP/2 concurrent requests multiplex over a few connections
+    app.state.http_client = httpx.AsyncClient(
+        http2=settings.http2,
+        limits=httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry
+        ),
+        timeout=httpx.Timeout(settings.http_timeout, connect=settings.http_connect_timeout)
+    )
+    
+    app.state.redis = redis.Redis.from_url(settings.redis_url) if settings.redis_url else None
+    app.state.webhook_handler = ShopifyWebhookHandler(settings, redis_client=app.state.redis)
+    # Warehouse origin is static config; validate it once, not per order
+    app.state.warehouse_address = ShippoAddress(**settings.warehouse_ca_address)
     app.state.shippo_service = ShippoService(
         api_token=settings.shippo_token,
         test_mode=settings.shippo_test_mode,
-        rate_limit_tier="standard"
+        rate_limit_tier=settings.shippo_rate_limit_tier,
+        http_client=app.state.http_client
     )
+    app.state.shopify_client = ShopifyClient(
+        shop_domain=settings.shopify_shop_domain,
+        access_token=settings.shopify_access_token,
+        api_version=settings.shopify_api_version,
+        http_client=app.state.http_client
+    )
+    
+    # Webhooks only enqueue; a fixed pool of workers does the fulfillment
+    app.state.order_queue = asyncio.Queue(maxsize=settings.order_queue_size)
+    workers = [
+        asyncio.create_task(order_worker(app.state.order_queue))
+        for _ in range(settings.max_concurrent_orders)
+    ]
     
     yield
     
     # Shutdown
     logger.info("Shutting down fulfillment service...")
-    # Cleanup handled by context managers
+    try:
+        await asyncio.wait_for(
+            app.state.order_queue.join(),
+            timeout=settings.shutdown_drain_timeout
+        )
+    except asyncio.TimeoutError:
+        dropped = drain_order_queue(app.state.order_queue)
+        logger.error(
+            "Shutdown drain timed out; %d queued orders were not fulfilled: %s",
+            len(dropped),
+            ", ".join(str(order.id) for order in dropped)
+        )
+    # Stop workers between orders rather than cancelling them, so an order
+    # that already bought a label still gets its Shopify fulfillment
+    for _ in workers:
+        await app.state.order_queue.put(None)
+    await asyncio.gather(*workers)
+    await app.state.http_client.aclose()
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+    root_logger.removeHandler(log_queue_handler)
+    log_listener.stop()
+
+
+def enqueue_order(shopify_order: ShopifyOrder) -> None:
+    """Queue an order for the workers, answering 503 when the backlog is full."""
+    try:
+        app.state.order_queue.put_nowait(shopify_order)
+    except asyncio.QueueFull:
+        logger.warning("Order queue full, deferring order %s", shopify_order.order_number)
+        raise HTTPException(
+            status_code=503,
+            detail="Order queue full, retry later"
+        )
+
+
+def drain_order_queue(queue: asyncio.Queue) -> List[ShopifyOrder]:
+    """Remove and return every order still waiting in the queue."""
+    dropped = []
+    while True:
+        try:
+            dropped.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            return dropped
+        queue.task_done()
+
+
+async def save_and_enqueue_order(shopify_order: ShopifyOrder) -> None:
+    """Save the order file off the event loop, then queue the order.
+
+    The file is removed again if the queue is full, so a 503 leaves no
+    order file behind for an order that was never accepted.
+    """
+    order_file = ORDERS_DIR / f"order_{shopify_order.id}.json"
+    await asyncio.to_thread(order_file.write_text, shopify_order.model_dump_json(indent=2))
+    try:
+        enqueue_order(shopify_order)
+    except HTTPException:
+        await asyncio.to_thread(order_file.unlink, missing_ok=True)
+        raise
+
+
+async def order_worker(queue: asyncio.Queue):
+    """Consume queued orders and fulfill them one at a time until a ``None`` sentinel."""
+    while True:
+        shopify_order = await queue.get()
+        try:
+            if shopify_order is None:
+                return
+            await process_order_fulfillment(shopify_order)
+        finally:
+            queue.task_done()
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson instead of the stdlib encoder."""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
 
 
 # Initialize FastAPI app with proper lifecycle management
@@ -59,13 +219,15 @@ app = FastAPI(
     title="Grooved Learning Fulfillment API",
     description="Production fulfillment system for educational products",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
     
 
 @app.get("/")
 async def root():
     """Health check endpoint."""
+    metrics.ROOT_REQUESTS.inc()
     return {
         "status": "healthy",
         "service": "Grooved Learning Fulfillment",
@@ -77,6 +239,7 @@ async def root():
 @app.get("/health")
 async def health():
     """Detailed health check with service dependencies."""
+    metrics.HEALTH_REQUESTS.inc()
     checks = {
         "api": "ok",
         "shippo_configured": bool(settings.shippo_token),
@@ -94,11 +257,20 @@ async def health():
 
 
 @app.post("/webhooks/shopify/order-create")
-async def handle_order_webhook(request: Request, background_tasks: BackgroundTasks):
+async def handle_order_webhook(request: Request):
     """Handle Shopify order creation webhook with proper validation."""
+    metrics.ORDER_WEBHOOK_REQUESTS.inc()
+    webhook_handler: ShopifyWebhookHandler = app.state.webhook_handler
+    
+    # Verify the signature before claiming the webhook id, so an unsigned
+    # request can't claim a genuine delivery and get it reported as a
+    # duplicate. Shopify retries deliveries; repeats then skip parsing
+    await webhook_handler.authenticate_webhook(request)
+    if not await webhook_handler.claim_delivery(request):
+        return DUPLICATE_RESPONSE
+    
     try:
         # Parse and validate webhook using our handler
-        webhook_handler: ShopifyWebhookHandler = app.state.webhook_handler
         shopify_order = await webhook_handler.parse_order_webhook(request)
         
         # Check if order should be processed
@@ -110,13 +282,8 @@ async def handle_order_webhook(request: Request, background_tasks: BackgroundTas
                 "reason": "Order not eligible for fulfillment"
             }
         
-        # Save order data to file for tracking
-        order_file = ORDERS_DIR / f"order_{shopify_order.id}.json"
-        with open(order_file, "w") as f:
-            f.write(shopify_order.model_dump_json(indent=2))
-        
-        # Process in background following our patterns
-        background_tasks.add_task(process_order_fulfillment, shopify_order)
+        # Save the order for tracking and hand it off to the fulfillment workers
+        await save_and_enqueue_order(shopify_order)
         
         return {
             "status": "accepted",
@@ -127,21 +294,51 @@ async def handle_order_webhook(request: Request, background_tasks: BackgroundTas
         
     except HTTPException:
         # Re-raise HTTP exceptions (validation errors, auth errors)
+        await webhook_handler.release_delivery(request)
         raise
     except Exception as e:
-        logger.error(f"Unexpected error processing webhook: {e}")
+        await webhook_handler.release_delivery(request)
+        logger.error("Unexpected error processing webhook: %s", e)
         raise HTTPException(
             status_code=500,
             detail="Internal server error processing webhook"
         )
 
 
+async def save_unfulfilled_label(
+    shopify_order: ShopifyOrder,
+    label_result: ShippoLabelResponse,
+    selected_rate: Dict[str, Any]
+) -> None:
+    """Record a purchased label whose Shopify fulfillment could not be created."""
+    logger.error(
+        "Label bought for order %s but not fulfilled in Shopify: "
+        "transaction %s, tracking %s",
+        shopify_order.order_number,
+        label_result.object_id,
+        label_result.tracking_number
+    )
+    label_file = ORDERS_DIR / f"label_{shopify_order.id}.json"
+    label = {
+        "order_id": shopify_order.id,
+        "order_number": shopify_order.order_number,
+        "transaction_id": label_result.object_id,
+        "tracking_number": label_result.tracking_number,
+        "label_url": label_result.label_url,
+        "rate": selected_rate
+    }
+    await asyncio.to_thread(
+        label_file.write_bytes, orjson.dumps(label, option=orjson.OPT_INDENT_2)
+    )
+
+
 async def process_order_fulfillment(shopify_order: ShopifyOrder):
     """
     Process order fulfillment using modular services.
     Follows error handling patterns from og-phonics project.
     """
-    logger.info(f"Processing fulfillment for order {shopify_order.order_number}")
+    logger.info("Processing fulfillment for order %s", shopify_order.order_number)
+    start_time = time.perf_counter()
     
     try:
         # Get services from app state
@@ -150,16 +347,17 @@ async def process_order_fulfillment(shopify_order: ShopifyOrder):
         
         # Extract shipping information
         shipping_info = webhook_handler.extract_shipping_info(shopify_order)
-        to_address = ShippoAddress(**shipping_info)
+        to_address = ShippoAddress.model_validate(shipping_info)
         
         # Use configured warehouse address
-        from_address = ShippoAddress(**settings.warehouse_ca_address)
+        from_address: ShippoAddress = app.state.warehouse_address
         
         # Calculate package weight from line items
         package_weight = webhook_handler.calculate_package_weight(shopify_order)
         
-        # Create parcel (simplified dimensions for now)
-        parcel = ShippoParcel(
+        # Create parcel (simplified dimensions for now); every field is a
+        # constant or our own float, so skip re-validating them per order
+        parcel = ShippoParcel.model_construct(
             length=10.0,
             width=8.0,
             height=4.0,
@@ -168,62 +366,55 @@ async def process_order_fulfillment(shopify_order: ShopifyOrder):
             mass_unit="lb"
         )
         
-        # Convert to Shippo order format
-        shippo_order = ShippoOrder(
-            order_number=shopify_order.order_number,
-            to_address=to_address,
-            from_address=from_address,
-            line_items=[
-                {
-                    "title": item.get("name", ""),
-                    "quantity": item.get("quantity", 1),
-                    "total_price": item.get("price", "0.00"),
-                    "currency": shopify_order.currency,
-                    "sku": item.get("sku", "")
-                }
-                for item in shopify_order.line_items
-            ],
-            placed_at=datetime.fromisoformat(shopify_order.created_at.replace('Z', '+00:00'))
-        )
+        # Dependency graph: label purchase (Shippo) and the open fulfillment
+        # order lookup (Shopify) are independent, so they run concurrently;
+        # only the Shopify fulfillment create needs both results
+        shopify_client: ShopifyClient = app.state.shopify_client
+        
+        async def buy_label():
+            # Create shipping label (skip packing slip for now to simplify);
+            # keep the purchased rate for its carrier and amount
+            shipment_data, selected_rate = await shippo_service.shop_rates(
+                from_address=from_address,
+                to_address=to_address,
+                parcel=parcel,
+                preferred_carrier=None  # Use cheapest rate
+            )
+            label = await shippo_service.create_label_with_known_rate(
+                shipment_data,
+                selected_rate["object_id"]
+            )
+            return label, selected_rate
         
-        # Create shipping label (skip packing slip for now to simplify)
-        label_result = await shippo_service.get_rates_and_create_label(
-            from_address=from_address,
-            to_address=to_address,
-            parcel=parcel,
-            preferred_carrier=None  # Use cheapest rate
+        # return_exceptions keeps a failed lookup from abandoning the label
+        # task: a label that was bought must be recorded either way
+        label_outcome, fulfillment_order = await asyncio.gather(
+            buy_label(),
+            shopify_client.get_open_fulfillment_order(shopify_order.id),
+            return_exceptions=True
         )
+        if isinstance(label_outcome, BaseException):
+            raise label_outcome
+        label_result, selected_rate = label_outcome
+        if isinstance(fulfillment_order, BaseException):
+            await save_unfulfilled_label(shopify_order, label_result, selected_rate)
+            raise fulfillment_order
         
         # Get tracking info
         tracking_number = label_result.tracking_number or f"TEST{shopify_order.id}"
-        carrier = getattr(label_result, 'rate_details', {}).get('provider', 'USPS')
+        carrier = selected_rate.get("provider", "")
         
         # Map to Shopify carrier format
-        carrier_mapping = {
-            "usps": "USPS",
-            "ups": "UPS",
-            "fedex": "FedEx",
-            "dhl_express": "DHL Express",
-        }
-        tracking_company = carrier_mapping.get(carrier.lower(), "Other")
+        tracking_company = SHOPIFY_CARRIER_NAMES.get(carrier.lower(), "Other")
         
         # Update Shopify with fulfillment
-        shopify_client = ShopifyClient(
-            shop_domain=settings.shopify_shop_domain,
-            access_token=settings.shopify_access_token,
-            api_version=settings.shopify_api_version
+        fulfillment = await shopify_client.create_fulfillment(
+            tracking_number=tracking_number,
+            tracking_company=tracking_company,
+            fulfillment_order_id=fulfillment_order["id"],
+            notify_customer=True
         )
         
-        async with shopify_client:
-            fulfillment = await shopify_client.update_order_fulfillment(
-                order_id=shopify_order.id,
-                fulfillment_data={
-                    "tracking_number": tracking_number,
-                    "tracking_company": tracking_company,
-                    "notify_customer": True
-                }
-            )
-        
         # Prepare result
         result = {
             "order_id": shopify_order.id,
@@ -233,7 +424,7 @@ async def process_order_fulfillment(shopify_order: ShopifyOrder):
                 "url": label_result.label_url or "N/A",
                 "tracking_number": tracking_number,
                 "carrier": tracking_company,
-                "cost": getattr(label_result, 'rate_details', {}).get('amount', '0.00')
+                "cost": selected_rate.get("amount", "0.00")
             },
             "shopify_fulfillment": {
                 "id": fulfillment["id"],
@@ -244,45 +435,56 @@ async def process_order_fulfillment(shopify_order: ShopifyOrder):
         
         # Save fulfillment result
         fulfillment_file = ORDERS_DIR / f"fulfillment_{shopify_order.id}.json"
-        with open(fulfillment_file, "w") as f:
-            import json
-            json.dump(result, f, indent=2)
+        await asyncio.to_thread(
+            fulfillment_file.write_bytes, orjson.dumps(result, option=orjson.OPT_INDENT_2)
+        )
         
         logger.info(
-            f"✅ Fulfillment completed for order {shopify_order.order_number}: "
-            f"Tracking: {tracking_number}, "
-            f"Shopify Fulfillment: {fulfillment['id']}"
+            "✅ Fulfillment completed for order %s: "
+            "Tracking: %s, "
+            "Shopify Fulfillment: %s",
+            shopify_order.order_number,
+            tracking_number,
+            fulfillment["id"]
         )
+        metrics.ORDERS_FULFILLED.inc()
         
     except ValueError as e:
-        logger.error(f"Validation error processing order {shopify_order.order_number}: {e}")
+        metrics.ORDERS_FAILED.inc()
+        logger.error("Validation error processing order %s: %s", shopify_order.order_number, e)
     except Exception as e:
-        logger.error(f"Failed to process order {shopify_order.order_number}: {e}")
+        metrics.ORDERS_FAILED.inc()
+        logger.error("Failed to process order %s: %s", shopify_order.order_number, e)
         # In production, this would trigger alerting/retry mechanisms
+    finally:
+        metrics.ORDER_PROCESSING_DURATION.observe(time.perf_counter() - start_time)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    return Response(content=metrics.render_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/orders/{order_id}")
 async def get_order(order_id: str):
     """Get order details with fulfillment status."""
+    metrics.ORDER_GET_REQUESTS.inc()
     order_file = ORDERS_DIR / f"order_{order_id}.json"
     if not order_file.exists():
         raise HTTPException(status_code=404, detail="Order not found")
         
-    with open(order_file) as f:
-        import json
-        order = json.load(f)
+    order = read_json_file(order_file)
         
     # Check for fulfillment data
     fulfillment_file = ORDERS_DIR / f"fulfillment_{order_id}.json"
     if fulfillment_file.exists():
-        with open(fulfillment_file) as f:
-            order["fulfillment"] = json.load(f)
+        order["fulfillment"] = read_json_file(fulfillment_file)
     else:
         # Check for legacy label data
         label_file = ORDERS_DIR / f"label_{order_id}.json"
         if label_file.exists():
-            with open(label_file) as f:
-                order["legacy_fulfillment"] = json.load(f)
+            order["legacy_fulfillment"] = read_json_file(label_file)
             
     return order
 
@@ -290,6 +492,7 @@ async def get_order(order_id: str):
 @app.get("/orders/{order_id}/status")
 async def get_order_status(order_id: str):
     """Get simplified order fulfillment status."""
+    metrics.ORDER_STATUS_REQUESTS.inc()
     fulfillment_file = ORDERS_DIR / f"fulfillment_{order_id}.json"
     
     if not fulfillment_file.exists():
@@ -299,9 +502,7 @@ async def get_order_status(order_id: str):
             "message": "Order not yet processed"
         }
     
-    with open(fulfillment_file) as f:
-        import json
-        fulfillment = json.load(f)
+    fulfillment = read_json_file(fulfillment_file)
     
     return {
         "order_id": order_id,
@@ -316,8 +517,9 @@ async def get_order_status(order_id: str):
 
 
 @app.post("/test/order-webhook")
-async def test_order_webhook(order_data: dict, background_tasks: BackgroundTasks):
+async def test_order_webhook(request: Request):
     """Test endpoint for order webhooks without signature verification."""
+    metrics.TEST_WEBHOOK_REQUESTS.inc()
     if not settings.use_test_mode:
         raise HTTPException(
             status_code=403,
@@ -325,8 +527,8 @@ async def test_order_webhook(order_data: dict, background_tasks: BackgroundTasks
         )
     
     try:
-        # Parse directly without signature verification
-        shopify_order = ShopifyOrder(**order_data)
+        # Parse the raw body directly without signature verification
+        shopify_order = ShopifyOrder.model_validate_json(await request.body())
         
         # Check if order should be processed
         webhook_handler: ShopifyWebhookHandler = app.state.webhook_handler
@@ -338,13 +540,8 @@ async def test_order_webhook(order_data: dict, background_tasks: BackgroundTasks
                 "reason": "Order not eligible for fulfillment"
             }
         
-        # Save order data to file for tracking
-        order_file = ORDERS_DIR / f"order_{shopify_order.id}.json"
-        with open(order_file, "w") as f:
-            f.write(shopify_order.model_dump_json(indent=2))
-        
-        # Process in background
-        background_tasks.add_task(process_order_fulfillment, shopify_order)
+        # Save the order for tracking and hand it off to the fulfillment workers
+        await save_and_enqueue_order(shopify_order)
         
         return {
             "status": "received",
@@ -353,8 +550,23 @@ async def test_order_webhook(order_data: dict, background_tasks: BackgroundTasks
             "message": "Test order webhook received and queued for processing"
         }
         
+    except HTTPException:
+        raise
+    except ValidationError as e:
+        # Leave out the offending input: for bad JSON it's raw bytes, which
+        # the error response can't serialise
+        errors = e.errors(include_url=False, include_context=False, include_input=False)
+        if any(error["type"] == "json_invalid" for error in errors):
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid JSON payload"
+            )
+        raise HTTPException(
+            status_code=422,
+            detail=errors
+        )
     except Exception as e:
-        logger.error(f"Test webhook error: {e}")
+        logger.error("Test webhook error: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Test webhook processing error: {str(e)}"
@@ -367,5 +579,7 @@ if __name__ == "__main__":
         "fulfillment.main:app",
         host=settings.api_host,
         port=settings.api_port,
-        reload=settings.debug
+        reload=settings.debug,
+        # Reload mode only supports a single worker process
+        workers=1 if settings.debug else settings.api_workers
     )
\ No newline at end of file
@@ -1,15 +1,26 @@
 """Shippo API integration for shipping labels and packing slips."""
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 import asyncio
 import httpx
 import logging
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime, timedelta
+from decimal import Decimal
 import backoff
 from contextlib import asynccontextmanager
 
+from fulfillment.utils.ratelimit import AsyncLeakyBucket, CircuitBreaker, is_non_retryable
+
+logger = logging.getLogger(__name__)
+
+# Flat per-order charge for the packing slip, added to the label rate
+PACKING_SLIP_COST = Decimal("0.05")
+
 # Pydantic Models for Type Safety
 class ShippoAddress(BaseModel):
+    # Read-only once built; the warehouse address is shared by every order
+    model_config = ConfigDict(frozen=True)
+    
     name: str
     street1: str
     street2: Optional[str] = None
@@ -20,7 +31,22 @@ class ShippoAddress(BaseModel):
     phone: Optional[str] = None
     email: Optional[str] = None
 
+# Fallback sender when an order has no from_address. Literal constants only,
+# so there is nothing to validate, and frozen, so one instance is shared
+DEFAULT_FROM_ADDRESS = ShippoAddress.model_construct(
+    name="Grooved Learning",
+    street1="[Your Warehouse Address]",
+    city="[Your City]",
+    state="[Your State]",
+    zip="[Your ZIP]",
+    country="US",
+    phone="[Your Phone]",
+    email="shipping@groovedlearning.com"
+)
+
 class ShippoParcel(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     length: float
     width: float
     height: float
@@ -61,7 +87,11 @@ class RateLimitConfig:
         }
         self.rpm = self.limits.get(tier, 300)
         self.requests_per_second = self.rpm / 60
-        self.semaphore = asyncio.Semaphore(int(self.requests_per_second * 2))
+        # Allow a two-second burst, then pace at the plan's steady rate
+        self.bucket = AsyncLeakyBucket(
+            rate=self.requests_per_second,
+            capacity=max(1, int(self.requests_per_second * 2))
+        )
 
 # Enhanced HTTP Client with Rate Limiting
 class ShippoClient:
@@ -74,41 +104,51 @@ class ShippoClient:
         base_url: str = "https://api.goshippo.com",
         timeout: int = 30,
         max_concurrent: int = 10,
-        rate_limit_tier: str = "standard"
+        rate_limit_tier: str = "standard",
+        http_client: Optional[httpx.AsyncClient] = None
     ):
         self.api_token = api_token
         self.test_mode = test_mode
         self.base_url = base_url.rstrip("/")
         self.rate_limit = RateLimitConfig(rate_limit_tier)
+        self.breaker = CircuitBreaker("shippo")
+        self.headers = {
+            "Authorization": f"ShippoToken {api_token}",
+            "Content-Type": "application/json",
+            "User-Agent": "Grooved-Learning-Shippo-Client/1.0"
+        }
         
-        # Configure httpx client with production settings
-        self.client = httpx.AsyncClient(
+        # Reuse the application's pooled client when given one; otherwise
+        # configure a private httpx client with production settings
+        self._owns_client = http_client is None
+        self.client = http_client or httpx.AsyncClient(
             timeout=httpx.Timeout(timeout),
             limits=httpx.Limits(
                 max_keepalive_connections=max_concurrent,
                 max_connections=max_concurrent * 2
-            ),
-            headers={
-                "Authorization": f"ShippoToken {api_token}",
-                "Content-Type": "application/json",
-                "User-Agent": "Grooved-Learning-Shippo-Client/1.0"
-            }
+            )
         )
         
-        self.logger = logging.getLogger(__name__)
+        self.logger = logger
     
     async def __aenter__(self):
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
+        await self.aclose()
+    
+    async def aclose(self):
+        """Close the underlying HTTP client if this instance created it"""
+        if self._owns_client:
+            await self.client.aclose()
     
     @backoff.on_exception(
         backoff.expo,
         (httpx.HTTPStatusError, httpx.ConnectError, httpx.TimeoutException),
         max_tries=3,
         max_time=60,
-        jitter=backoff.full_jitter
+        jitter=backoff.full_jitter,
+        giveup=is_non_retryable
     )
     async def _make_request(
         self, 
@@ -116,39 +156,33 @@ class ShippoClient:
         endpoint: str, 
         **kwargs
     ) -> httpx.Response:
-        """Make rate-limited HTTP request with exponential backoff retry"""
+        """Make rate-limited HTTP request; only 5xx/429/transport errors are retried"""
         
-        async with self.rate_limit.semaphore:
+        self.breaker.check()
+        async with self.rate_limit.bucket:
             url = f"{self.base_url}/{endpoint.lstrip('/')}"
             
             try:
-                response = await self.client.request(method, url, **kwargs)
+                response = await self.client.request(method, url, headers=self.headers, **kwargs)
+                self.breaker.record(response)
                 
-                # Handle rate limiting
+                # Handle rate limiting: hold the bucket so queued callers wait too
                 if response.status_code == 429:
                     retry_after = int(response.headers.get("Retry-After", "60"))
-                    self.logger.warning(f"Rate limited, waiting {retry_after}s")
-                    await asyncio.sleep(retry_after)
-                    raise httpx.HTTPStatusError(
-                        f"Rate limited", 
-                        request=response.request, 
-                        response=response
-                    )
+                    self.logger.warning("Rate limited, pausing for %ss", retry_after)
+                    self.rate_limit.bucket.pause(retry_after)
                 
                 response.raise_for_status()
                 return response
                 
             except httpx.HTTPStatusError as e:
-                self.logger.error(f"HTTP error {e.response.status_code}: {e}")
-                if e.response.status_code >= 500:
-                    # Server errors should be retried
-                    raise
-                else:
-                    # Client errors should not be retried
+                self.logger.error("HTTP error %s: %s", e.response.status_code, e)
+                if is_non_retryable(e):
                     self._handle_client_error(e)
-                    raise
+                raise
             except (httpx.ConnectError, httpx.TimeoutException) as e:
-                self.logger.error(f"Connection error: {e}")
+                self.logger.error("Connection error: %s", e)
+                self.breaker.record_failure()
                 raise
     
     def _handle_client_error(self, error: httpx.HTTPStatusError):
@@ -165,15 +199,30 @@ class ShippoClient:
         }
         
         message = error_details.get(status_code, f"Client error: {status_code}")
-        self.logger.error(f"{message}: {error.response.text}")
+        self.logger.error("%s: %s", message, error.response.text)
 
 # Main Shippo Service Class
 class ShippoService:
     """Production Shippo integration service following Grooved Learning patterns"""
     
-    def __init__(self, api_token: str, test_mode: bool = False, rate_limit_tier: str = "standard"):
-        self.client = ShippoClient(api_token, test_mode=test_mode, rate_limit_tier=rate_limit_tier)
-        self.logger = logging.getLogger(__name__)
+    def __init__(
+        self,
+        api_token: str,
+        test_mode: bool = False,
+        rate_limit_tier: str = "standard",
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
+        self.client = ShippoClient(
+            api_token,
+            test_mode=test_mode,
+            rate_limit_tier=rate_limit_tier,
+            http_client=http_client
+        )
+        self.logger = logger
+    
+    async def aclose(self):
+        """Release HTTP resources owned by the service"""
+        await self.client.aclose()
     
     async def create_order(self, order: ShippoOrder) -> Dict[str, Any]:
         """Create order in Shippo system"""
@@ -189,13 +238,12 @@ class ShippoService:
         if order.from_address:
             order_data["from_address"] = order.from_address.model_dump()
         
-        async with self.client as client:
-            response = await client._make_request(
-                "POST", 
-                "/orders/", 
-                json=order_data
-            )
-            return response.json()
+        response = await self.client._make_request(
+            "POST", 
+            "/orders/", 
+            json=order_data
+        )
+        return response.json()
     
     async def create_label_with_known_rate(
         self,
@@ -211,26 +259,23 @@ class ShippoService:
             "async": False  # Synchronous label creation
         }
         
-        async with self.client as client:
-            response = await client._make_request(
-                "POST",
-                "/transactions/",
-                json=transaction_data
-            )
-            
-            result = response.json()
-            return ShippoLabelResponse(**result)
+        response = await self.client._make_request(
+            "POST",
+            "/transactions/",
+            json=transaction_data
+        )
+        
+        return ShippoLabelResponse.model_validate_json(response.content)
     
-    async def get_rates_and_create_label(
+    async def shop_rates(
         self,
         from_address: ShippoAddress,
         to_address: ShippoAddress,
         parcel: ShippoParcel,
         preferred_carrier: Optional[str] = None
-    ) -> ShippoLabelResponse:
-        """Two-step process: get rates, then create label (rate shopping)"""
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Create a shipment and pick its best rate; returns (shipment_data, rate)"""
         
-        # Step 1: Create shipment to get rates
         shipment_data = {
             "address_from": from_address.model_dump(),
             "address_to": to_address.model_dump(),
@@ -238,34 +283,41 @@ class ShippoService:
             "async": False
         }
         
-        async with self.client as client:
-            # Get available rates
-            shipment_response = await client._make_request(
-                "POST",
-                "/shipments/",
-                json=shipment_data
-            )
-            
-            shipment = shipment_response.json()
-            rates = shipment.get("rates", [])
-            
-            if not rates:
-                raise ValueError("No shipping rates available")
-            
-            # Select best rate (cheapest by default, or preferred carrier)
-            selected_rate = self._select_best_rate(rates, preferred_carrier)
-            
-            # Step 2: Purchase label
-            label_response = await self.create_label_with_known_rate(
-                shipment_data, 
-                selected_rate["object_id"]
-            )
-            
-            # Add the full rate details to the response for convenience
-            label_response_dict = label_response.model_dump()
-            label_response_dict["rate_details"] = selected_rate
-            
-            return label_response
+        # Get available rates
+        shipment_response = await self.client._make_request(
+            "POST",
+            "/shipments/",
+            json=shipment_data
+        )
+        
+        shipment = shipment_response.json()
+        rates = shipment.get("rates", [])
+        
+        if not rates:
+            raise ValueError("No shipping rates available")
+        
+        # Select best rate (cheapest by default, or preferred carrier)
+        return shipment_data, self._select_best_rate(rates, preferred_carrier)
+    
+    async def get_rates_and_create_label(
+        self,
+        from_address: ShippoAddress,
+        to_address: ShippoAddress,
+        parcel: ShippoParcel,
+        preferred_carrier: Optional[str] = None
+    ) -> ShippoLabelResponse:
+        """Two-step process: get rates, then create label (rate shopping)"""
+        
+        # Step 1: Create shipment to get rates
+        shipment_data, selected_rate = await self.shop_rates(
+            from_address, to_address, parcel, preferred_carrier
+        )
+        
+        # Step 2: Purchase label
+        return await self.create_label_with_known_rate(
+            shipment_data, 
+            selected_rate["object_id"]
+        )
     
     def _select_best_rate(
         self, 
@@ -274,38 +326,42 @@ class ShippoService:
     ) -> Dict[str, Any]:
         """Select the best shipping rate based on criteria"""
         
-        valid_rates = [r for r in rates if r.get("messages", []) == []]
+        # One pass: track the cheapest valid rate overall and for the
+        # preferred carrier, instead of filtering into lists and re-scanning
+        preferred = preferred_carrier.lower() if preferred_carrier else None
+        best = best_preferred = None
+        best_amount = best_preferred_amount = 0.0
         
-        if not valid_rates:
-            raise ValueError("No valid shipping rates available")
+        for rate in rates:
+            if rate.get("messages", []) != []:
+                continue
+            amount = float(rate["amount"])
+            if best is None or amount < best_amount:
+                best, best_amount = rate, amount
+            if preferred and rate.get("provider", "").lower() == preferred:
+                if best_preferred is None or amount < best_preferred_amount:
+                    best_preferred, best_preferred_amount = rate, amount
         
-        # Prefer specific carrier if requested
-        if preferred_carrier:
-            carrier_rates = [
-                r for r in valid_rates 
-                if r.get("provider", "").lower() == preferred_carrier.lower()
-            ]
-            if carrier_rates:
-                return min(carrier_rates, key=lambda x: float(x["amount"]))
+        if best is None:
+            raise ValueError("No valid shipping rates available")
         
-        # Default: cheapest rate
-        return min(valid_rates, key=lambda x: float(x["amount"]))
+        # Prefer specific carrier if requested; default: cheapest rate
+        return best_preferred or best
     
     async def get_packing_slip(self, order_id: str) -> ShippoPackingSlipResponse:
         """Get packing slip PDF URL for order (expires in 24 hours)"""
         
-        async with self.client as client:
-            response = await client._make_request(
-                "GET",
-                f"/orders/{order_id}/packingslip/"
-            )
-            
-            result = response.json()
-            
-            return ShippoPackingSlipResponse(
-                packing_slip_url=result.get("packing_slip_url", ""),
-                expires_at=datetime.now() + timedelta(hours=24)
-            )
+        response = await self.client._make_request(
+            "GET",
+            f"/orders/{order_id}/packingslip/"
+        )
+        
+        result = response.json()
+        
+        return ShippoPackingSlipResponse.model_construct(
+            packing_slip_url=result.get("packing_slip_url", ""),
+            expires_at=datetime.now() + timedelta(hours=24)
+        )
     
     async def create_combined_label_and_packing_slip(
         self,
@@ -319,50 +375,48 @@ class ShippoService:
         """
         
         try:
-            # Step 1: Create order in Shippo
-            order_result = await self.create_order(order)
+            # Step 1: Create the Shippo order and shop rates concurrently;
+            # neither depends on the other and rate quotes are free
+            order_result, (shipment_data, selected_rate) = await asyncio.gather(
+                self.create_order(order),
+                self.shop_rates(
+                    from_address=order.from_address or self._get_default_from_address(),
+                    to_address=order.to_address,
+                    parcel=parcel,
+                    preferred_carrier=preferred_carrier
+                )
+            )
             order_id = order_result["object_id"]
             
-            # Step 2: Create shipping label
-            label_result = await self.get_rates_and_create_label(
-                from_address=order.from_address or self._get_default_from_address(),
-                to_address=order.to_address,
-                parcel=parcel,
-                preferred_carrier=preferred_carrier
+            # Step 2: Purchase the label (only once both succeeded) alongside
+            # the packing slip lookup
+            label_result, packing_slip_result = await asyncio.gather(
+                self.create_label_with_known_rate(shipment_data, selected_rate["object_id"]),
+                self.get_packing_slip(order_id)
             )
             
-            # Step 3: Get packing slip
-            packing_slip_result = await self.get_packing_slip(order_id)
-            
             return {
                 "order_id": order_id,
                 "label": {
                     "url": label_result.label_url,
                     "tracking_number": label_result.tracking_number,
-                    "rate_amount": getattr(label_result, 'rate_details', {}).get("amount", "0.00"),
-                    "carrier": getattr(label_result, 'rate_details', {}).get("provider", "")
+                    "rate_amount": selected_rate.get("amount", "0.00"),
+                    "carrier": selected_rate.get("provider", "")
                 },
                 "packing_slip": {
                     "url": packing_slip_result.packing_slip_url,
                     "expires_at": packing_slip_result.expires_at.isoformat()
                 },
-                "total_cost": float(getattr(label_result, 'rate_details', {}).get("amount", "0.00")) + 0.05,  # Label + $0.05 packing slip
+                # Label + packing slip, summed from Shippo's decimal string
+                # so e.g. 4.35 + 0.05 doesn't come out as 4.3999999999999995
+                "total_cost": float(Decimal(selected_rate.get("amount", "0.00")) + PACKING_SLIP_COST),
                 "created_at": datetime.now().isoformat()
             }
             
         except Exception as e:
-            self.logger.error(f"Failed to create combined label and packing slip: {e}")
+            self.logger.error("Failed to create combined label and packing slip: %s", e)
             raise
     
     def _get_default_from_address(self) -> ShippoAddress:
         """Default Grooved Learning shipping address"""
-        return ShippoAddress(
-            name="Grooved Learning",
-            street1="[Your Warehouse Address]",
-            city="[Your City]",
-            state="[Your State]",
-            zip="[Your ZIP]",
-            country="US",
-            phone="[Your Phone]",
-            email="shipping@groovedlearning.com"
-        )
\ No newline at end of file
+        return DEFAULT_FROM_ADDRESS
\ No newline at end of file
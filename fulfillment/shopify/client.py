@@ -1,81 +1,147 @@
 """Shopify API client for interacting with Shopify Admin API."""
 import httpx
-from typing import Dict, Any, Optional, List
+import orjson
+import backoff
+from typing import Dict, Any, Optional, List, Sequence
 import logging
 from datetime import datetime
+from itertools import chain
+
+from fulfillment.utils.ratelimit import AsyncLeakyBucket, CircuitBreaker, is_unsafe_retry
 
 logger = logging.getLogger(__name__)
 
+# Shopify's REST bucket holds 20 seconds of leak: 40 @ 2/s standard, 400 @ 20/s Plus
+SHOPIFY_BUCKET_SECONDS = 20
+CALL_LIMIT_HEADER = "X-Shopify-Shop-Api-Call-Limit"
+
 
 class ShopifyClient:
     """Client for Shopify Admin API operations."""
     
-    def __init__(self, shop_domain: str, access_token: str, api_version: str = "2025-01"):
-        """Initialize Shopify client."""
+    def __init__(
+        self,
+        shop_domain: str,
+        access_token: str,
+        api_version: str = "2025-01",
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
+        """
+        Initialize Shopify client.
+
+        Pass a shared ``http_client`` to reuse pooled connections; otherwise a
+        private client is opened by the async context manager and kept open
+        until the outermost ``async with`` block exits (or ``close()``).
+        """
         self.shop_domain = shop_domain.replace("https://", "").replace("http://", "")
         self.access_token = access_token
         self.api_version = api_version
         self.base_url = f"https://{self.shop_domain}/admin/api/{api_version}"
-        self.client = None
+        self.headers = {
+            "X-Shopify-Access-Token": self.access_token,
+            "Content-Type": "application/json"
+        }
+        self.client = http_client
+        self._owns_client = http_client is None
+        self._entered = 0
+        self.bucket = AsyncLeakyBucket(rate=2.0, capacity=40)
+        self.breaker = CircuitBreaker("shopify")
         
     async def __aenter__(self):
-        """Async context manager entry."""
-        self.client = httpx.AsyncClient(
-            headers={
-                "X-Shopify-Access-Token": self.access_token,
-                "Content-Type": "application/json"
-            },
-            timeout=30.0
-        )
+        """Async context manager entry; nested entries share one client."""
+        if self._owns_client and (self.client is None or self.client.is_closed):
+            self.client = httpx.AsyncClient(
+                timeout=30.0,
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20)
+            )
+        self._entered += 1
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        """Async context manager exit."""
-        if self.client:
+        """Async context manager exit; the outermost exit closes the client."""
+        self._entered -= 1
+        if self._entered == 0:
+            await self.close()
+    
+    async def close(self) -> None:
+        """Close the private client, if this instance opened one."""
+        if self._owns_client and self.client and not self.client.is_closed:
             await self.client.aclose()
     
+    @backoff.on_exception(
+        backoff.expo,
+        (httpx.HTTPStatusError, httpx.ConnectError, httpx.TimeoutException),
+        max_tries=3,
+        max_time=60,
+        jitter=backoff.full_jitter,
+        giveup=is_unsafe_retry
+    )
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a rate-limited Admin API request and raise on HTTP errors."""
+        self.breaker.check()
+        try:
+            async with self.bucket:
+                response = await self.client.request(
+                    method,
+                    f"{self.base_url}/{path}",
+                    headers=self.headers,
+                    **kwargs
+                )
+        except (httpx.ConnectError, httpx.TimeoutException):
+            self.breaker.record_failure()
+            raise
+        self.breaker.record(response)
+        self._update_bucket(response)
+        response.raise_for_status()
+        return response
+    
+    def _update_bucket(self, response: httpx.Response) -> None:
+        """Follow Shopify's reported bucket usage (e.g. ``32/40``) and Retry-After."""
+        call_limit = response.headers.get(CALL_LIMIT_HEADER)
+        if call_limit:
+            used, _, limit = call_limit.partition("/")
+            if used.isdigit() and limit.isdigit():
+                self.bucket.rate = int(limit) / SHOPIFY_BUCKET_SECONDS
+                self.bucket.sync(int(used), int(limit))
+        if response.status_code == 429:
+            retry_after = float(response.headers.get("Retry-After", "2.0"))
+            logger.warning("Shopify rate limit hit, pausing for %ss", retry_after)
+            self.bucket.pause(retry_after)
+    
     async def get_orders(self, **params) -> Dict[str, Any]:
         """Fetch orders from Shopify."""
         try:
-            response = await self.client.get(
-                f"{self.base_url}/orders.json",
-                params=params
-            )
-            response.raise_for_status()
+            response = await self._request("GET", "orders.json", params=params)
             
-            # Include headers in response for pagination
+            # Include headers in response for pagination; httpx.Headers is
+            # already a case-insensitive mapping, so hand it over uncopied
             return {
-                "orders": response.json().get("orders", []),
-                "headers": dict(response.headers)
+                "orders": orjson.loads(response.content).get("orders", []),
+                "headers": response.headers
             }
         except httpx.HTTPError as e:
-            logger.error(f"Error fetching orders: {e}")
+            logger.error("Error fetching orders: %s", e)
             if hasattr(e, 'response') and e.response:
-                logger.error(f"Response: {e.response.text}")
+                logger.error("Response: %s", e.response.text)
             raise
     
     async def get_order(self, order_id: str) -> Dict[str, Any]:
         """Fetch a specific order."""
         try:
-            response = await self.client.get(
-                f"{self.base_url}/orders/{order_id}.json"
-            )
-            response.raise_for_status()
-            return response.json()["order"]
+            response = await self._request("GET", f"orders/{order_id}.json")
+            return orjson.loads(response.content)["order"]
         except httpx.HTTPError as e:
-            logger.error(f"Error fetching order {order_id}: {e}")
+            logger.error("Error fetching order %s: %s", order_id, e)
             raise
     
     async def get_fulfillment_orders(self, order_id: str) -> List[Dict[str, Any]]:
         """Get fulfillment orders for an order."""
         try:
-            response = await self.client.get(
-                f"{self.base_url}/orders/{order_id}/fulfillment_orders.json"
-            )
-            response.raise_for_status()
-            return response.json()["fulfillment_orders"]
+            response = await self._request("GET", f"orders/{order_id}/fulfillment_orders.json")
+            return orjson.loads(response.content)["fulfillment_orders"]
         except httpx.HTTPError as e:
-            logger.error(f"Error getting fulfillment orders for order {order_id}: {e}")
+            logger.error("Error getting fulfillment orders for order %s: %s", order_id, e)
             raise
     
     async def create_fulfillment(self, tracking_number: str, tracking_company: str, 
@@ -98,29 +164,28 @@ class ShopifyClient:
                 }
             }
             
-            response = await self.client.post(
-                f"{self.base_url}/fulfillments.json",
-                json=fulfillment_data
-            )
-            response.raise_for_status()
-            return response.json()["fulfillment"]
+            response = await self._request("POST", "fulfillments.json", json=fulfillment_data)
+            return orjson.loads(response.content)["fulfillment"]
         except httpx.HTTPError as e:
-            logger.error(f"Error creating fulfillment: {e}")
+            logger.error("Error creating fulfillment: %s", e)
             if hasattr(e, 'response') and e.response:
-                logger.error(f"Response: {e.response.text}")
+                logger.error("Response: %s", e.response.text)
             raise
     
-    async def update_order_fulfillment(self, order_id: str, fulfillment_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Create a fulfillment for an order (compatibility method)."""
-        # Get fulfillment orders first
+    async def get_open_fulfillment_order(self, order_id: str) -> Dict[str, Any]:
+        """Get the first open fulfillment order, raising ValueError if there is none."""
         fulfillment_orders = await self.get_fulfillment_orders(order_id)
         if not fulfillment_orders:
             raise ValueError(f"No fulfillment orders found for order {order_id}")
         
-        # Use the first open fulfillment order
         fo = next((fo for fo in fulfillment_orders if fo["status"] == "open"), None)
         if not fo:
             raise ValueError(f"No open fulfillment orders found for order {order_id}")
+        return fo
+    
+    async def update_order_fulfillment(self, order_id: str, fulfillment_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create a fulfillment for an order (compatibility method)."""
+        fo = await self.get_open_fulfillment_order(order_id)
         
         # Create fulfillment using the newer API
         return await self.create_fulfillment(
@@ -133,8 +198,9 @@ class ShopifyClient:
     async def register_webhook(self, topic: str, address: str) -> Dict[str, Any]:
         """Register a webhook with Shopify."""
         try:
-            response = await self.client.post(
-                f"{self.base_url}/webhooks.json",
+            response = await self._request(
+                "POST",
+                "webhooks.json",
                 json={
                     "webhook": {
                         "topic": topic,
@@ -143,22 +209,79 @@ class ShopifyClient:
                     }
                 }
             )
-            response.raise_for_status()
-            return response.json()["webhook"]
+            return orjson.loads(response.content)["webhook"]
         except httpx.HTTPError as e:
-            logger.error(f"Error registering webhook: {e}")
+            logger.error("Error registering webhook: %s", e)
             if hasattr(e, 'response') and e.response:
-                logger.error(f"Response: {e.response.text}")
+                logger.error("Response: %s", e.response.text)
+            raise
+    
+    async def register_webhooks(
+        self,
+        topics: List[str],
+        address: str,
+        replace_ids: Sequence[int] = ()
+    ) -> List[Dict[str, Any]]:
+        """
+        Register several webhook topics in a single GraphQL round trip.
+        
+        Each REST topic (e.g. ``orders/create``) becomes an aliased
+        ``webhookSubscriptionCreate`` mutation in one document. Webhook ids in
+        ``replace_ids`` are deleted by aliased ``webhookSubscriptionDelete``
+        mutations placed ahead of the creates, which Shopify runs in order.
+        """
+        # Generators feed the join directly; no intermediate lists to concatenate
+        deletes = (
+            f"  d{i}: webhookSubscriptionDelete(id: $d{i}) "
+            "{ deletedWebhookSubscriptionId userErrors { field message } }"
+            for i in range(len(replace_ids))
+        )
+        creates = (
+            f"  w{i}: webhookSubscriptionCreate("
+            f"topic: {topic.upper().replace('/', '_')}, webhookSubscription: $subscription) "
+            "{ webhookSubscription { id topic } userErrors { field message } }"
+            for i, topic in enumerate(topics)
+        )
+        params = "".join(f", $d{i}: ID!" for i in range(len(replace_ids)))
+        fields = "\n".join(chain(deletes, creates))
+        query = f"mutation($subscription: WebhookSubscriptionInput!{params}) {{\n{fields}\n}}"
+        
+        variables: Dict[str, Any] = {"subscription": {"callbackUrl": address, "format": "JSON"}}
+        for i, webhook_id in enumerate(replace_ids):
+            variables[f"d{i}"] = f"gid://shopify/WebhookSubscription/{webhook_id}"
+        
+        try:
+            response = await self._request(
+                "POST",
+                "graphql.json",
+                json={"query": query, "variables": variables}
+            )
+        except httpx.HTTPError as e:
+            logger.error("Error registering webhooks: %s", e)
             raise
+        
+        payload = orjson.loads(response.content)
+        if payload.get("errors"):
+            raise ValueError(f"Failed to register webhooks: {payload['errors']}")
+        
+        data = payload.get("data") or {}
+        for i, webhook_id in enumerate(replace_ids):
+            result = data.get(f"d{i}") or {}
+            if result.get("userErrors"):
+                raise ValueError(f"Failed to delete webhook {webhook_id}: {result['userErrors']}")
+        webhooks = []
+        for i, topic in enumerate(topics):
+            result = data.get(f"w{i}") or {}
+            if result.get("userErrors"):
+                raise ValueError(f"Failed to register webhook {topic}: {result['userErrors']}")
+            webhooks.append(result.get("webhookSubscription"))
+        return webhooks
     
     async def list_webhooks(self) -> List[Dict[str, Any]]:
         """List all registered webhooks."""
         try:
-            response = await self.client.get(
-                f"{self.base_url}/webhooks.json"
-            )
-            response.raise_for_status()
-            return response.json()["webhooks"]
+            response = await self._request("GET", "webhooks.json")
+            return orjson.loads(response.content)["webhooks"]
         except httpx.HTTPError as e:
-            logger.error(f"Error listing webhooks: {e}")
+            logger.error("Error listing webhooks: %s", e)
             raise
\ No newline at end of file
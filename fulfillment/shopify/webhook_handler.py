@@ -1,17 +1,37 @@
 """Shopify webhook handler following Grooved Learning patterns."""
-import json
 import hmac
-import hashlib
 import base64
+import binascii
 import logging
 from typing import Dict, Any, Optional
+import redis.asyncio as redis
 from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, ValidationError
 
 from fulfillment.utils.config import Settings
+from fulfillment.utils.idempotency import IdempotencyStore
 
 logger = logging.getLogger(__name__)
 
+# Shopify redelivers a webhook (same id) when it doesn't see a fast 2xx
+WEBHOOK_ID_HEADER = "X-Shopify-Webhook-Id"
+GRAMS_PER_POUND = 453.592
+
+# Bodies at least this large are hashed off the event loop
+HMAC_THREAD_MIN_BYTES = 64 * 1024
+
+# HMAC-SHA256 digest size and the length of its base64 encoding
+SIGNATURE_DIGEST_LEN = 32
+SIGNATURE_HEADER_LEN = 44
+
+# Static error bodies, copied with per-request details on failure
+_ERR_VALIDATION = {
+    "error_code": "VALIDATION_ERROR",
+    "message": "Order data validation failed",
+    "details": None
+}
+
 
 class ShopifyOrder(BaseModel):
     """Shopify order webhook payload model."""
@@ -32,10 +52,67 @@ class ShopifyOrder(BaseModel):
 class ShopifyWebhookHandler:
     """Production webhook handler with signature verification."""
     
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, redis_client: Optional[redis.Redis] = None):
         self.settings = settings
         self.webhook_secret = settings.shopify_webhook_secret
-        self.logger = logging.getLogger(__name__)
+        self._secret_bytes = self.webhook_secret.encode('utf-8')
+        self.max_body_bytes = settings.webhook_max_body_bytes
+        # Redis makes delivery claims visible to every worker; without it,
+        # claims are tracked per process
+        self.idempotency = IdempotencyStore(
+            ttl=settings.webhook_dedup_ttl,
+            redis_client=redis_client
+        )
+        self.logger = logger
+    
+    async def claim_delivery(self, request: Request) -> bool:
+        """
+        Atomically claim this webhook id for processing.
+        
+        Returns False when another delivery with the same id already claimed
+        it. Requests without an id header are always processed.
+        """
+        webhook_id = request.headers.get(WEBHOOK_ID_HEADER)
+        if not webhook_id:
+            return True
+        return await self.idempotency.claim(webhook_id)
+    
+    async def release_delivery(self, request: Request) -> None:
+        """Drop a claim after a failed attempt so Shopify's retry is processed."""
+        webhook_id = request.headers.get(WEBHOOK_ID_HEADER)
+        if webhook_id:
+            await self.idempotency.release(webhook_id)
+    
+    async def read_body(self, request: Request) -> bytes:
+        """
+        Buffer the request body, refusing anything over ``max_body_bytes``.
+        
+        The cap is enforced while reading, so chunked requests without a
+        Content-Length can't get past it. The body is kept on
+        ``request.state`` for the signature check and parsing to share.
+        """
+        body = getattr(request.state, "raw_body", None)
+        if body is not None:
+            return body
+        
+        chunks = []
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail="Webhook payload too large"
+                )
+            chunks.append(chunk)
+        
+        body = b"".join(chunks)
+        request.state.raw_body = body
+        return body
+    
+    def _sign(self, body: bytes) -> bytes:
+        """Single-shot HMAC-SHA256 of the raw body with the webhook secret."""
+        return hmac.digest(self._secret_bytes, body, "sha256")
     
     async def verify_webhook_signature(self, request: Request) -> bool:
         """Verify webhook signature using HMAC-SHA256."""
@@ -49,65 +126,90 @@ class ShopifyWebhookHandler:
             self.logger.error("Missing webhook signature header")
             return False
         
-        # Get raw body
-        body = await request.body()
+        # Shopify sends the base64 of a 32-byte digest. Reject anything else
+        # before hashing the body; header length isn't secret, so this
+        # early exit leaks nothing
+        provided_signature = b""
+        if len(signature_header) == SIGNATURE_HEADER_LEN:
+            try:
+                provided_signature = base64.b64decode(signature_header, validate=True)
+            except (binascii.Error, ValueError):
+                pass
+        if len(provided_signature) != SIGNATURE_DIGEST_LEN:
+            self.logger.error("Malformed webhook signature header")
+            return False
         
-        # Calculate expected signature
-        expected_signature = hmac.new(
-            self.webhook_secret.encode('utf-8'),
-            body,
-            hashlib.sha256
-        ).digest()  # Use digest() instead of hexdigest()
+        # Get raw body
+        body = await self.read_body(request)
         
-        # Shopify sends base64 encoded signature
-        expected_signature_base64 = base64.b64encode(expected_signature).decode('utf-8')
+        # Calculate expected signature; hashlib drops the GIL on large
+        # inputs, so big payloads hash in a thread instead of the event loop
+        if len(body) >= HMAC_THREAD_MIN_BYTES:
+            expected_signature = await run_in_threadpool(self._sign, body)
+        else:
+            expected_signature = self._sign(body)
         
-        # Compare signatures
-        is_valid = hmac.compare_digest(signature_header, expected_signature_base64)
+        is_valid = hmac.compare_digest(expected_signature, provided_signature)
         
         if not is_valid:
-            self.logger.error(f"Invalid webhook signature. Expected: {expected_signature_base64[:10]}..., Got: {signature_header[:10]}...")
+            self.logger.error("Invalid webhook signature. Got: %s...", signature_header[:10])
         
         return is_valid
     
+    async def authenticate_webhook(self, request: Request) -> None:
+        """
+        Reject oversized or unsigned webhooks.
+        
+        Raises 413 or 401. Run this before claiming the delivery id, so an
+        unsigned request can't claim the id of a genuine delivery.
+        """
+        # Refuse oversized payloads before buffering them
+        content_length = request.headers.get("Content-Length", "")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail="Webhook payload too large"
+            )
+        
+        if not await self.verify_webhook_signature(request):
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid webhook signature"
+            )
+    
     async def parse_order_webhook(self, request: Request) -> ShopifyOrder:
-        """Parse and validate Shopify order webhook payload."""
+        """Parse and validate an order webhook already passed by authenticate_webhook."""
+        body = await self.read_body(request)
+        
         try:
-            # Verify signature first
-            if not await self.verify_webhook_signature(request):
-                raise HTTPException(
-                    status_code=401,
-                    detail="Invalid webhook signature"
-                )
-            
-            # Parse JSON payload
-            body = await request.body()
-            order_data = json.loads(body)
-            
-            # Validate with Pydantic
-            order = ShopifyOrder(**order_data)
+            # Parse and validate in one pydantic-core pass, no intermediate dict
+            order = ShopifyOrder.model_validate_json(body)
             
             self.logger.info(
-                f"Parsed order webhook: {order.order_number} "
-                f"(ID: {order.id}, Status: {order.financial_status})"
+                "Parsed order webhook: %s (ID: %s, Status: %s)",
+                order.order_number,
+                order.id,
+                order.financial_status
             )
             
             return order
             
         except ValidationError as e:
-            self.logger.error(f"Order validation error: {e}")
+            # e.errors() is structured already; str(e) re-renders every error
+            errors = e.errors(include_url=False, include_context=False)
+            if any(error["type"] == "json_invalid" for error in errors):
+                self.logger.error("JSON decode error: %s", errors[0]["msg"])
+                raise HTTPException(
+                    status_code=400,
+                    detail="Invalid JSON payload"
+                )
+            self.logger.error("Order validation error: %d invalid field(s)", len(errors))
             raise HTTPException(
                 status_code=422,
-                detail=f"Invalid order data: {e}"
-            )
-        except json.JSONDecodeError as e:
-            self.logger.error(f"JSON decode error: {e}")
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid JSON payload"
+                detail={**_ERR_VALIDATION, "details": {"validation_errors": errors}}
             )
         except Exception as e:
-            self.logger.error(f"Unexpected error parsing webhook: {e}")
+            self.logger.error("Unexpected error parsing webhook: %s", e)
             raise HTTPException(
                 status_code=500,
                 detail="Internal server error"
@@ -118,29 +220,30 @@ class ShopifyWebhookHandler:
         # Only process paid orders
         if order.financial_status.lower() != "paid":
             self.logger.info(
-                f"Skipping order {order.order_number} - "
-                f"financial status: {order.financial_status}"
+                "Skipping order %s - financial status: %s",
+                order.order_number,
+                order.financial_status
             )
             return False
         
         # Skip if already fulfilled
         if order.fulfillment_status == "fulfilled":
             self.logger.info(
-                f"Skipping order {order.order_number} - already fulfilled"
+                "Skipping order %s - already fulfilled", order.order_number
             )
             return False
         
         # Must have shipping address
         if not order.shipping_address:
             self.logger.warning(
-                f"Skipping order {order.order_number} - no shipping address"
+                "Skipping order %s - no shipping address", order.order_number
             )
             return False
         
         # Must have line items
         if not order.line_items:
             self.logger.warning(
-                f"Skipping order {order.order_number} - no line items"
+                "Skipping order %s - no line items", order.order_number
             )
             return False
         
@@ -152,32 +255,39 @@ class ShopifyWebhookHandler:
         if not shipping:
             raise ValueError("No shipping address available")
         
+        # Only build the fallbacks when the preferred key is absent
+        get = shipping.get
+        if "name" in shipping:
+            name = shipping["name"]
+        else:
+            # Shopify sends null for missing name parts, so coerce before joining
+            first, last = get("first_name") or "", get("last_name") or ""
+            name = f"{first} {last}".strip() if first or last else ""
+        if "province_code" in shipping:
+            state = shipping["province_code"]
+        else:
+            state = get("province", "")
+        
         return {
-            "name": shipping.get(
-                "name", 
-                f"{shipping.get('first_name', '')} {shipping.get('last_name', '')}".strip()
-            ),
-            "street1": shipping.get("address1", ""),
-            "street2": shipping.get("address2", ""),
-            "city": shipping.get("city", ""),
-            "state": shipping.get("province_code", shipping.get("province", "")),
-            "zip": shipping.get("zip", ""),
-            "country": shipping.get("country_code", "US"),
-            "phone": shipping.get("phone", ""),
+            "name": name,
+            "street1": get("address1", ""),
+            "street2": get("address2", ""),
+            "city": get("city", ""),
+            "state": state,
+            "zip": get("zip", ""),
+            "country": get("country_code", "US"),
+            "phone": get("phone", ""),
             "email": order.email or ""
         }
     
     def calculate_package_weight(self, order: ShopifyOrder) -> float:
         """Calculate total package weight from line items."""
-        total_weight = 0.0
-        
-        for item in order.line_items:
-            # Get weight in grams, convert to pounds
-            weight_grams = float(item.get("grams", 0))
-            weight_pounds = weight_grams / 453.592  # grams to pounds
-            quantity = int(item.get("quantity", 1))
-            
-            total_weight += weight_pounds * quantity
+        # Sum grams in one pass and convert to pounds once at the end
+        total_grams = sum(
+            float(item.get("grams", 0)) * int(item.get("quantity", 1))
+            for item in order.line_items
+        )
+        total_weight = total_grams / GRAMS_PER_POUND
         
         # Minimum weight of 1 lb for small items
         return max(total_weight, 1.0)
\ No newline at end of file
@@ -18,6 +18,7 @@ class Settings(BaseSettings):
     shippo_api_token: str = os.getenv("SHIPPING_SHIPPO_API_TOKEN", "")
     shippo_test_token: str = os.getenv("SHIPPING_SHIPPO_TEST_API_TOKEN", "")
     shippo_test_mode: bool = os.getenv("ENVIRONMENT", "development") != "production"
+    shippo_rate_limit_tier: str = os.getenv("SHIPPING_SHIPPO_RATE_LIMIT_TIER", "standard")
     use_test_mode: bool = os.getenv("ENVIRONMENT", "development") != "production"
     
     # Shopify Configuration
@@ -37,6 +38,27 @@ class Settings(BaseSettings):
     api_host: str = "0.0.0.0"
     api_port: int = int(os.getenv("API_PORT", "8750"))
     debug: bool = os.getenv("DEBUG", "false").lower() == "true"
+    # Dedup (without Redis), rate limiters and metrics are per process, so
+    # extra workers are opt-in
+    api_workers: int = int(os.getenv("API_WORKERS", "1"))
+    
+    # Redis Configuration (optional; enables cross-worker webhook dedup)
+    redis_url: str = os.getenv("REDIS_URL", "")
+    webhook_dedup_ttl: int = int(os.getenv("WEBHOOK_DEDUP_TTL", "86400"))
+    webhook_max_body_bytes: int = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", str(5 * 1024 * 1024)))
+    
+    # Order Processing Configuration
+    max_concurrent_orders: int = int(os.getenv("MAX_CONCURRENT_ORDERS", "4"))
+    order_queue_size: int = int(os.getenv("ORDER_QUEUE_SIZE", "1000"))
+    shutdown_drain_timeout: float = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30.0"))
+    
+    # Outbound HTTP Configuration (shared by Shopify and Shippo clients)
+    http_max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    http_max_keepalive_connections: int = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    http_timeout: float = float(os.getenv("HTTP_TIMEOUT", "30.0"))
+    http_connect_timeout: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.0"))
+    http_keepalive_expiry: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60.0"))
+    http2: bool = os.getenv("HTTP2", "true").lower() == "true"
     
     @property
     def shippo_token(self) -> str:
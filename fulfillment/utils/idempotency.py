@@ -0,0 +1,54 @@
+"""Idempotency claims for externally delivered events (e.g. Shopify webhooks)."""
+import logging
+from typing import Optional
+
+import redis.asyncio as redis
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on ids remembered per process when Redis is absent or unreachable
+LOCAL_MAX_ENTRIES = 100_000
+
+
+class IdempotencyStore:
+    """
+    Claim event ids so each one is processed at most once.
+
+    With Redis a claim is a single atomic ``SET key 1 NX EX ttl``, shared by
+    every worker and expired by Redis itself. Without it, or while Redis is
+    unreachable, claims fall back to a bounded per-process TTL cache, which
+    only dedupes within a single instance.
+    """
+
+    def __init__(
+        self,
+        ttl: int,
+        redis_client: Optional[redis.Redis] = None,
+        prefix: str = "wh:shopify:"
+    ):
+        self.ttl = ttl
+        self.redis = redis_client
+        self.prefix = prefix
+        self._local: TTLCache = TTLCache(maxsize=LOCAL_MAX_ENTRIES, ttl=ttl)
+
+    async def claim(self, event_id: str) -> bool:
+        """Return True if this call claimed ``event_id``, False if already claimed."""
+        if self.redis is not None:
+            try:
+                return bool(await self.redis.set(self.prefix + event_id, "1", nx=True, ex=self.ttl))
+            except redis.RedisError as e:
+                logger.warning("Redis claim failed, using in-process dedup: %s", e)
+        if event_id in self._local:
+            return False
+        self._local[event_id] = True
+        return True
+
+    async def release(self, event_id: str) -> None:
+        """Drop a claim (e.g. after a failed attempt) so a redelivery is processed."""
+        self._local.pop(event_id, None)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(self.prefix + event_id)
+            except redis.RedisError as e:
+                logger.warning("Redis release failed for %s: %s", event_id, e)
@@ -0,0 +1,43 @@
+"""Prometheus metrics for the fulfillment API."""
+from cachetools.func import ttl_cache
+from prometheus_client import Counter, Histogram, generate_latest
+
+REQUEST_COUNT = Counter(
+    "fulfillment_requests_total",
+    "HTTP requests received, by method and endpoint",
+    ["method", "endpoint"]
+)
+
+ORDERS_PROCESSED = Counter(
+    "fulfillment_orders_processed_total",
+    "Orders that finished background fulfillment, by outcome",
+    ["outcome"]
+)
+
+# Fulfillment is a handful of Shippo + Shopify round trips, so sub-100ms
+# buckets would stay empty; each bucket costs work per observe() and scrape
+ORDER_PROCESSING_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+
+ORDER_PROCESSING_DURATION = Histogram(
+    "fulfillment_order_processing_seconds",
+    "Time to fulfill an order: label purchase plus Shopify update",
+    buckets=ORDER_PROCESSING_BUCKETS
+)
+
+# Pre-bound label handles: handlers call .inc() directly instead of paying
+# a labels() tuple hash + child dict lookup on every request
+ROOT_REQUESTS = REQUEST_COUNT.labels("GET", "/")
+HEALTH_REQUESTS = REQUEST_COUNT.labels("GET", "/health")
+ORDER_WEBHOOK_REQUESTS = REQUEST_COUNT.labels("POST", "/webhooks/shopify/order-create")
+ORDER_GET_REQUESTS = REQUEST_COUNT.labels("GET", "/orders/{order_id}")
+ORDER_STATUS_REQUESTS = REQUEST_COUNT.labels("GET", "/orders/{order_id}/status")
+TEST_WEBHOOK_REQUESTS = REQUEST_COUNT.labels("POST", "/test/order-webhook")
+
+ORDERS_FULFILLED = ORDERS_PROCESSED.labels("fulfilled")
+ORDERS_FAILED = ORDERS_PROCESSED.labels("failed")
+
+
+@ttl_cache(maxsize=1, ttl=1)
+def render_latest() -> bytes:
+    """Render the registry, reusing the output for scrapes within one second."""
+    return generate_latest()
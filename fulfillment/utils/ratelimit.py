@@ -0,0 +1,121 @@
+"""Async rate limiting helpers for outbound API clients."""
+import asyncio
+import time
+
+import httpx
+
+
+class AsyncLeakyBucket:
+    """
+    Leaky-bucket limiter that paces callers instead of letting them hit 429s.
+
+    Up to ``capacity`` requests may burst; after that callers are released at
+    ``rate`` requests per second. Waiters queue on a FIFO lock, so call order
+    is preserved and nobody spins in a sleep-and-retry loop.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = 0.0
+        self._last_leak = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _leak(self) -> None:
+        """Drain the bucket by the time elapsed since the last leak."""
+        now = time.monotonic()
+        self._level = max(0.0, self._level - (now - self._last_leak) * self.rate)
+        self._last_leak = now
+
+    async def acquire(self) -> None:
+        """Wait until the bucket has room for one more request."""
+        async with self._lock:
+            self._leak()
+            overflow = self._level + 1 - self.capacity
+            if overflow > 0:
+                await asyncio.sleep(overflow / self.rate)
+                self._leak()
+            self._level += 1
+
+    def sync(self, used: int, capacity: int) -> None:
+        """Align the local bucket with usage reported by the remote API."""
+        self._leak()
+        self.capacity = capacity
+        self._level = float(used)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back the next caller for ``seconds`` (e.g. after a Retry-After)."""
+        self._leak()
+        self._level = max(self._level, self.capacity - 1 + seconds * self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return None
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that has been failing."""
+
+
+class CircuitBreaker:
+    """
+    Fail fast while an upstream API is down.
+
+    After ``fail_max`` consecutive 5xx or transport failures the circuit opens
+    and calls raise ``CircuitOpenError`` without touching the network. Once
+    ``reset_timeout`` seconds pass, calls are let through again; one more
+    failure re-opens it, a success closes it.
+    """
+
+    def __init__(self, name: str, fail_max: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+
+    def check(self) -> None:
+        """Raise ``CircuitOpenError`` if the circuit is open."""
+        if self._failures >= self.fail_max and time.monotonic() - self._opened_at < self.reset_timeout:
+            raise CircuitOpenError(f"{self.name} circuit open after {self._failures} failures")
+
+    def record_failure(self) -> None:
+        """Count a failed call, opening the circuit at ``fail_max``."""
+        self._failures += 1
+        if self._failures >= self.fail_max:
+            self._opened_at = time.monotonic()
+
+    def record(self, response: httpx.Response) -> None:
+        """Record a completed call: 5xx counts as a failure, anything else resets."""
+        if response.status_code >= 500:
+            self.record_failure()
+        else:
+            self._failures = 0
+
+
+def is_non_retryable(error: Exception) -> bool:
+    """Backoff ``giveup`` predicate: only 5xx, 429 and transport errors retry."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code < 500 and status_code != 429
+    return False
+
+
+def is_unsafe_retry(error: Exception) -> bool:
+    """Backoff ``giveup`` predicate that also refuses to replay writes.
+
+    A write that timed out or got a 5xx may already have been applied, so
+    only reads retry those. Writes retry only on a 429 or a failed connect,
+    where the request is known not to have been processed.
+    """
+    if is_non_retryable(error):
+        return True
+    if isinstance(error, httpx.ConnectError):
+        return False
+    if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+        return False
+    return error.request.method not in ("GET", "HEAD")
+
@@ -8,4 +8,5 @@ echo ""
 echo "Press Ctrl+C to stop"
 echo ""
 
+# --reload runs a single worker; production (python main.py) runs API_WORKERS (default 1)
 cd fulfillment && uv run uvicorn main:app --reload --port 8750
\ No newline at end of file
@@ -13,44 +13,45 @@ from dotenv import load_dotenv
 load_dotenv()
 
 FULFILLMENT_API_URL = os.getenv("FULFILLMENT_API_URL", "http://localhost:8750")
+# Orders in flight at once; the server queues them and rate-limits Shippo itself
+CONCURRENCY = int(os.getenv("FULFILLMENT_CONCURRENCY", "4"))
 
 
-async def process_order(order_data):
-    """Send order to fulfillment API."""
-    async with httpx.AsyncClient() as client:
-        try:
-            # Simulate webhook payload
-            webhook_payload = {
-                "id": order_data["id"],
-                "email": order_data["email"],
-                "created_at": order_data["created_at"],
-                "currency": order_data["currency"],
-                "total_price": order_data["total_price"],
-                "subtotal_price": order_data["subtotal_price"],
-                "total_tax": order_data["total_tax"],
-                "financial_status": order_data["financial_status"],
-                "fulfillment_status": order_data["fulfillment_status"],
-                "name": order_data["name"],
-                "order_number": order_data["order_number"],
-                "line_items": order_data["line_items"],
-                "shipping_address": order_data["shipping_address"],
-                "customer": order_data["customer"],
-                "shipping_lines": order_data["shipping_lines"]
-            }
-            
-            response = await client.post(
-                f"{FULFILLMENT_API_URL}/webhook/order/created",
-                json=webhook_payload,
-                headers={"Content-Type": "application/json"}
-            )
+async def process_order(client: httpx.AsyncClient, order_data):
+    """Send order to fulfillment API over the caller's pooled client."""
+    try:
+        # Simulate webhook payload
+        webhook_payload = {
+            "id": order_data["id"],
+            "email": order_data["email"],
+            "created_at": order_data["created_at"],
+            "currency": order_data["currency"],
+            "total_price": order_data["total_price"],
+            "subtotal_price": order_data["subtotal_price"],
+            "total_tax": order_data["total_tax"],
+            "financial_status": order_data["financial_status"],
+            "fulfillment_status": order_data["fulfillment_status"],
+            "name": order_data["name"],
+            "order_number": order_data["order_number"],
+            "line_items": order_data["line_items"],
+            "shipping_address": order_data["shipping_address"],
+            "customer": order_data["customer"],
+            "shipping_lines": order_data["shipping_lines"]
+        }
+        
+        response = await client.post(
+            f"{FULFILLMENT_API_URL}/webhook/order/created",
+            json=webhook_payload,
+            headers={"Content-Type": "application/json"}
+        )
+        
+        if response.status_code == 200:
+            print(f"✅ Processed order {order_data['name']} - {response.json()}")
+        else:
+            print(f"❌ Failed to process order {order_data['name']}: {response.status_code} - {response.text}")
             
-            if response.status_code == 200:
-                print(f"✅ Processed order {order_data['name']} - {response.json()}")
-            else:
-                print(f"❌ Failed to process order {order_data['name']}: {response.status_code} - {response.text}")
-                
-        except Exception as e:
-            print(f"❌ Error processing order {order_data['name']}: {e}")
+    except Exception as e:
+        print(f"❌ Error processing order {order_data['name']}: {e}")
 
 
 async def main():
@@ -103,11 +104,23 @@ async def main():
             print("💡 Start the server with: ./run_fulfillment.sh")
             return
         
-        # Process orders
+        # Process orders with a fixed pool of workers sharing one client,
+        # so at most CONCURRENCY requests are in flight
         print("\n📤 Sending orders to fulfillment system...")
+        queue = asyncio.Queue()
         for order in unfulfilled:
-            await process_order(order)
-            await asyncio.sleep(1)  # Rate limiting
+            queue.put_nowait(order)
+        
+        async def worker(client: httpx.AsyncClient):
+            while True:
+                try:
+                    order = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await process_order(client, order)
+        
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(worker(client) for _ in range(CONCURRENCY)))
     
     print("\n✨ Processing complete!")
 
@@ -9,8 +9,15 @@ import os
 import httpx
 import asyncio
 import json
+from functools import lru_cache
 from dotenv import load_dotenv
 from pathlib import Path
+import sys
+
+# Add fulfillment module to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from fulfillment.shopify.client import ShopifyClient
 
 # Load environment variables
 load_dotenv(Path(__file__).parent / ".env")
@@ -21,68 +28,36 @@ SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2024-01")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "https://your-domain.com/webhooks/shopify/order-create")
 
 
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.AsyncClient:
+    """Shared client so list and register reuse one Shopify connection."""
+    return httpx.AsyncClient()
+
+
+@lru_cache(maxsize=1)
+def get_shopify_client() -> ShopifyClient:
+    """Admin API client over the shared connection."""
+    return ShopifyClient(
+        shop_domain=f"{SHOPIFY_SHOP_DOMAIN}.myshopify.com",
+        access_token=SHOPIFY_ACCESS_TOKEN,
+        api_version=SHOPIFY_API_VERSION,
+        http_client=get_http_client()
+    )
+
+
 async def list_webhooks():
     """List existing webhooks."""
-    url = f"https://{SHOPIFY_SHOP_DOMAIN}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}/webhooks.json"
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            url,
-            headers={"X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN}
-        )
-        
-        if response.status_code == 200:
-            webhooks = response.json()["webhooks"]
-            return webhooks
-        else:
-            print(f"❌ Error listing webhooks: {response.status_code}")
-            print(response.text)
-            return []
-
-
-async def create_webhook():
-    """Create order creation webhook."""
-    url = f"https://{SHOPIFY_SHOP_DOMAIN}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}/webhooks.json"
-    
-    webhook_data = {
-        "webhook": {
-            "topic": "orders/create",
-            "address": WEBHOOK_URL,
-            "format": "json"
-        }
-    }
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            url,
-            headers={"X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN},
-            json=webhook_data
-        )
-        
-        if response.status_code == 201:
-            webhook = response.json()["webhook"]
-            return webhook
-        else:
-            print(f"❌ Error creating webhook: {response.status_code}")
-            print(response.text)
-            return None
-
-
-async def delete_webhook(webhook_id):
-    """Delete a webhook."""
-    url = f"https://{SHOPIFY_SHOP_DOMAIN}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}/webhooks/{webhook_id}.json"
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.delete(
-            url,
-            headers={"X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN}
-        )
-        
-        return response.status_code == 200
+    try:
+        return await get_shopify_client().list_webhooks()
+    except httpx.HTTPError as e:
+        print(f"❌ Error listing webhooks: {e}")
+        return []
 
 
 async def main():
     """Main setup flow."""
+    global WEBHOOK_URL
+    
     print("🛍️  Shopify Webhook Setup")
     print(f"Shop: {SHOPIFY_SHOP_DOMAIN}")
     print(f"Webhook URL: {WEBHOOK_URL}")
@@ -93,6 +68,9 @@ async def main():
         print("❌ Missing Shopify configuration in .env")
         print("   Required: SHOPIFY_SHOP_DOMAIN, SHOPIFY_ACCESS_TOKEN")
         return
+    
+    # Fetch existing webhooks while the user answers any prompts below
+    webhooks_task = asyncio.create_task(list_webhooks())
         
     if WEBHOOK_URL == "https://your-domain.com/webhooks/shopify/order-create":
         print("⚠️  Using default webhook URL - for testing only!")
@@ -106,14 +84,15 @@ async def main():
         print("   3. Set WEBHOOK_URL=https://YOUR-NGROK-ID.ngrok.io/webhooks/shopify/order-create")
         print()
         
-        use_local = input("Use localhost URL for testing? (y/n): ").lower() == 'y'
+        answer = await asyncio.to_thread(input, "Use localhost URL for testing? (y/n): ")
+        use_local = answer.lower() == 'y'
         if use_local:
             WEBHOOK_URL = "http://localhost:8000/webhooks/shopify/order-create"
             print(f"   Using: {WEBHOOK_URL}")
     
     # List existing webhooks
     print("\n📋 Checking existing webhooks...")
-    webhooks = await list_webhooks()
+    webhooks = await webhooks_task
     
     if webhooks:
         print(f"Found {len(webhooks)} webhook(s):")
@@ -125,26 +104,36 @@ async def main():
         order_webhooks = [w for w in webhooks if w['topic'] == 'orders/create']
         if order_webhooks:
             print("\n⚠️  Order creation webhook already exists!")
-            replace = input("Replace existing webhook? (y/n): ").lower() == 'y'
-            if replace:
-                for webhook in order_webhooks:
-                    await delete_webhook(webhook['id'])
-                    print(f"   ✅ Deleted webhook {webhook['id']}")
-            else:
+            answer = await asyncio.to_thread(input, "Replace existing webhook? (y/n): ")
+            replace = answer.lower() == 'y'
+            if not replace:
                 print("   Keeping existing webhook")
                 return
     else:
+        order_webhooks = []
         print("   No existing webhooks found")
     
-    # Create new webhook
+    # Delete replaced webhooks and create the new one in one GraphQL request
     print(f"\n🔧 Creating order webhook...")
-    webhook = await create_webhook()
+    try:
+        webhooks = await get_shopify_client().register_webhooks(
+            ["orders/create"],
+            WEBHOOK_URL,
+            replace_ids=[w['id'] for w in order_webhooks]
+        )
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"❌ Failed to create webhook: {e}")
+        return
+    
+    for webhook in order_webhooks:
+        print(f"   ✅ Deleted webhook {webhook['id']}")
+    webhook = webhooks[0]
     
     if webhook:
         print(f"✅ Webhook created successfully!")
         print(f"   ID: {webhook['id']}")
         print(f"   Topic: {webhook['topic']}")
-        print(f"   URL: {webhook['address']}")
+        print(f"   URL: {WEBHOOK_URL}")
         print()
         print("🎯 Next steps:")
         print("   1. Make sure your fulfillment server is running")
@@ -154,5 +143,13 @@ async def main():
         print("❌ Failed to create webhook")
 
 
+async def run():
+    """Run the setup flow and close the shared client."""
+    try:
+        await main()
+    finally:
+        await get_http_client().aclose()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(run())
\ No newline at end of file
@@ -11,6 +11,7 @@ import os
 import httpx
 import asyncio
 import json
+import sys
 from datetime import datetime, timedelta
 from pathlib import Path
 from dotenv import load_dotenv
@@ -24,6 +25,15 @@ SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
 SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2024-01")
 
 
+if sys.version_info >= (3, 11):
+    # 3.11+ accepts Shopify's trailing "Z" natively
+    parse_shopify_timestamp = datetime.fromisoformat
+else:
+    def parse_shopify_timestamp(value: str) -> datetime:
+        """Parse a Shopify ISO 8601 timestamp, which may end in "Z"."""
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
 async def fetch_orders(status="any", created_at_min=None, limit=250):
     """
     Fetch orders from Shopify.
@@ -82,16 +92,17 @@ async def analyze_orders(orders):
     """Analyze orders for fulfillment insights."""
     total_orders = len(orders)
     unfulfilled = [o for o in orders if not o.get("fulfillment_status")]
-    fulfilled = [o for o in orders if o.get("fulfillment_status") == "fulfilled"]
+    # Only the count of fulfilled orders is used, so don't build a list
+    fulfilled_count = sum(1 for o in orders if o.get("fulfillment_status") == "fulfilled")
     
     # Calculate potential savings
     # Assuming average shipping cost of $8 vs Shippo's $5.50
-    potential_savings = len(fulfilled) * 2.50
+    potential_savings = fulfilled_count * 2.50
     
     print(f"\n📊 Order Analysis")
     print(f"{'='*50}")
     print(f"Total orders: {total_orders}")
-    print(f"Fulfilled: {len(fulfilled)}")
+    print(f"Fulfilled: {fulfilled_count}")
     print(f"Unfulfilled: {len(unfulfilled)}")
     print(f"Potential savings on fulfilled orders: ${potential_savings:,.2f}")
     
@@ -99,7 +110,7 @@ async def analyze_orders(orders):
     if unfulfilled:
         print(f"\n📦 Recent Unfulfilled Orders:")
         for order in unfulfilled[:10]:
-            created = datetime.fromisoformat(order['created_at'].replace('Z', '+00:00'))
+            created = parse_shopify_timestamp(order['created_at'])
             days_old = (datetime.now(created.tzinfo) - created).days
             print(f"   - Order #{order['order_number']} - ${order['total_price']} - {days_old} days old")
     
@@ -119,8 +130,13 @@ async def save_orders(orders, directory="data/shopify_orders"):
     print(f"\n💾 Saved {len(orders)} orders to {output_dir}")
 
 
-async def send_to_fulfillment(orders, base_url="http://localhost:8750"):
-    """Send orders to the fulfillment system for processing."""
+async def send_to_fulfillment(orders, base_url="http://localhost:8750", concurrency=5):
+    """
+    Send orders to the fulfillment system for processing.
+    
+    Orders are posted by ``concurrency`` workers, so at most that many
+    requests are in flight and the server's rate limits aren't flooded.
+    """
     print(f"\n🚀 Sending {len(orders)} orders to fulfillment system...")
     
     async with httpx.AsyncClient(timeout=30.0) as client:
@@ -135,21 +151,36 @@ async def send_to_fulfillment(orders, base_url="http://localhost:8750"):
             print(f"   Make sure it's running on {base_url}")
             return
         
-        # Send orders
-        success = 0
+        # A fixed pool of workers drains the queue, so a large import only
+        # ever has ``concurrency`` coroutines alive; each result is reported
+        # as soon as it arrives rather than after the whole batch
+        queue = asyncio.Queue()
         for order in orders:
-            try:
-                response = await client.post(
-                    f"{base_url}/webhooks/shopify/order-create",
-                    json=order
-                )
-                if response.status_code == 200:
+            queue.put_nowait(order)
+        success = 0
+        
+        async def worker():
+            nonlocal success
+            while True:
+                try:
+                    order = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    result = await client.post(
+                        f"{base_url}/webhooks/shopify/order-create",
+                        json=order
+                    )
+                except Exception as e:
+                    print(f"   ❌ Order #{order['order_number']} error: {e}")
+                    continue
+                if result.status_code == 200:
                     success += 1
                     print(f"   ✅ Order #{order['order_number']} sent")
                 else:
-                    print(f"   ❌ Order #{order['order_number']} failed: {response.status_code}")
-            except Exception as e:
-                print(f"   ❌ Order #{order['order_number']} error: {e}")
+                    print(f"   ❌ Order #{order['order_number']} failed: {result.status_code}")
+        
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
                 
         print(f"\n✅ Successfully sent {success}/{len(orders)} orders")
 
@@ -221,7 +252,7 @@ async def main():
         # Filter by end date if provided
         if end:
             end_date = datetime.fromisoformat(f"{end}T23:59:59+00:00")
-            orders = [o for o in orders if datetime.fromisoformat(o['created_at'].replace('Z', '+00:00')) <= end_date]
+            orders = [o for o in orders if parse_shopify_timestamp(o['created_at']) <= end_date]
             
         print(f"Found {len(orders)} orders")
         
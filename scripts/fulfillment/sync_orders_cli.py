@@ -3,6 +3,7 @@
 import asyncio
 import argparse
 import json
+import re
 from datetime import datetime, timedelta
 from pathlib import Path
 import sys
@@ -13,6 +14,9 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from fulfillment.shopify.client import ShopifyClient
 from fulfillment.utils.config import Settings
 
+# Cursor for the next page in Shopify's Link header
+PAGE_INFO_RE = re.compile(r'page_info=([^&>]+)')
+
 
 async def fetch_orders(status="any", created_at_min=None, limit=250):
     """Fetch orders from Shopify."""
@@ -52,8 +56,7 @@ async def fetch_orders(status="any", created_at_min=None, limit=250):
                         link_header = response["headers"]["link"]
                         if 'rel="next"' in link_header:
                             # Extract page_info from link
-                            import re
-                            match = re.search(r'page_info=([^&>]+)', link_header)
+                            match = PAGE_INFO_RE.search(link_header)
                             if match:
                                 params = {"page_info": match.group(1), "limit": limit}
                             else:
@@ -67,14 +67,7 @@ async def main():
         )
         
         # Create addresses
-        from_address = ShippoAddress(
-            name=settings.warehouse_ca_address["name"],
-            street1=settings.warehouse_ca_address["street1"],
-            city=settings.warehouse_ca_address["city"],
-            state=settings.warehouse_ca_address["state"],
-            zip=settings.warehouse_ca_address["zip"],
-            country=settings.warehouse_ca_address["country"]
-        )
+        from_address = ShippoAddress(**settings.warehouse_ca_address)
         
         to_address = ShippoAddress(
             name=order["shipping_address"]["name"],
@@ -66,16 +66,7 @@ async def create_test_shipment(order):
             country=order["shipping_address"]["country_code"],
             phone=order["shipping_address"].get("phone", "")
         ),
-        from_address=ShippoAddress(
-            name=settings.warehouse_ca_address["name"],
-            street1=settings.warehouse_ca_address["street1"],
-            street2=settings.warehouse_ca_address.get("street2", ""),
-            city=settings.warehouse_ca_address["city"],
-            state=settings.warehouse_ca_address["state"],
-            zip=settings.warehouse_ca_address["zip"],
-            country=settings.warehouse_ca_address["country"],
-            phone=settings.warehouse_ca_address.get("phone", "")
-        ),
+        from_address=ShippoAddress(street2="", phone="", **settings.warehouse_ca_address),
         line_items=[
             {
                 "title": item["name"],
@@ -100,27 +91,24 @@ async def create_test_shipment(order):
     
     # Create shipment with label (skip order/packing slip for now)
     try:
-        # Just create the label
-        result = await service.get_rates_and_create_label(
+        # Just create the label, keeping the purchased rate
+        shipment_data, selected_rate = await service.shop_rates(
             from_address=shippo_order.from_address,
             to_address=shippo_order.to_address,
             parcel=parcel,
             preferred_carrier=None  # Let it choose cheapest
         )
+        result = await service.create_label_with_known_rate(
+            shipment_data,
+            selected_rate["object_id"]
+        )
         
         print(f"✅ Created shipment with label")
         print(f"🏷️  Label URL: {result.label_url}")
         print(f"📮 Tracking Number: {result.tracking_number}")
-        
-        # Get rate details if available
-        if hasattr(result, 'rate_details'):
-            print(f"💰 Cost: ${float(result.rate_details['amount']):.2f}")
-            print(f"🚚 Carrier: {result.rate_details['provider']}")
-            carrier = result.rate_details['provider']
-        else:
-            print(f"💰 Cost: N/A (test mode)")
-            print(f"🚚 Carrier: N/A (test mode)")
-            carrier = "Other"
+        print(f"💰 Cost: ${float(selected_rate['amount']):.2f}")
+        print(f"🚚 Carrier: {selected_rate['provider']}")
+        carrier = selected_rate['provider']
         
         return {
             "label": {
@@ -193,8 +193,9 @@ async def send_test_webhook():
     
     # Prepare webhook data
     order_data = SAMPLE_ORDER.copy()
-    order_data["id"] = int(datetime.now().timestamp() * 1000)  # Unique ID
-    order_data["order_number"] = 1000 + int(datetime.now().timestamp() % 1000)
+    now = datetime.now().timestamp()
+    order_data["id"] = int(now * 1000)  # Unique ID
+    order_data["order_number"] = 1000 + int(now % 1000)
     order_data["name"] = f"#{order_data['order_number']}"
     
     # Convert to JSON
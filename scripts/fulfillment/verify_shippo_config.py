@@ -113,9 +113,13 @@ async def main():
     # Check for --test-live flag
     test_live = "--test-live" in sys.argv
     
-    # Test tokens if available
+    # Test tokens if available; both checks are independent HTTP calls, so
+    # they run concurrently and results are labeled by mode
+    test_check = None
+    live_check = None
+    
     if config["has_test"]:
-        test_valid = await test_shippo_token(config["test_token"], is_test=True)
+        test_check = test_shippo_token(config["test_token"], is_test=True)
     else:
         test_valid = False
         print("\n⚠️  Cannot test TEST token - not configured")
@@ -123,7 +127,7 @@ async def main():
     if config["has_live"]:
         if test_live:
             print("\n🔍 Testing LIVE token (--test-live flag provided)...")
-            live_valid = await test_shippo_token(config["live_token"], is_test=False)
+            live_check = test_shippo_token(config["live_token"], is_test=False)
         else:
             live_valid = None
             print("\n✋ Live token detected but not tested")
@@ -132,6 +136,13 @@ async def main():
         live_valid = False
         print("\n⚠️  Cannot test LIVE token - not configured")
     
+    checks = [check for check in (test_check, live_check) if check is not None]
+    results = iter(await asyncio.gather(*checks))
+    if test_check is not None:
+        test_valid = next(results)
+    if live_check is not None:
+        live_valid = next(results)
+    
     # Summary
     print("\n" + "=" * 50)
     print("📊 Configuration Summary:")
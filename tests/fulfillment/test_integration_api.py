@@ -1,16 +1,24 @@
 #!/usr/bin/env python3
 """Integration tests for the FastAPI fulfillment service."""
+import asyncio
 import pytest
 from pathlib import Path
 import sys
 import json
+import logging
+from logging.handlers import QueueHandler
 from unittest.mock import AsyncMock, patch
 
 # Add fulfillment module to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 from fastapi.testclient import TestClient
-from fulfillment.main import app
+from fulfillment.main import (
+    app, ORDERS_DIR, drain_order_queue, log_queue_handler, log_stream_handler,
+    order_worker, process_order_fulfillment
+)
+from fulfillment.shippo.client import ShippoLabelResponse
+from fulfillment.shopify.webhook_handler import ShopifyOrder
 
 
 @pytest.fixture
@@ -130,4 +138,293 @@ def test_app_lifespan():
     # This test ensures the app can start and stop without errors
     with TestClient(app) as client:
         response = client.get("/health")
-        assert response.status_code == 200
\ No newline at end of file
+        assert response.status_code == 200
+
+@patch("fulfillment.main.process_order_fulfillment")
+def test_webhook_handler_duplicate_delivery(mock_process, client):
+    """Test that a redelivered webhook id is short-circuited."""
+    order_data = {
+        "id": 12346,
+        "order_number": "GL-1002",
+        "name": "#GL-1002",
+        "total_price": "0.00",
+        "currency": "USD",
+        "financial_status": "pending",
+        "created_at": "2024-01-15T10:30:00Z",
+        "updated_at": "2024-01-15T10:30:00Z"
+    }
+    headers = {"X-Shopify-Webhook-Id": "dup-test-webhook-1"}
+    
+    with patch("fulfillment.shopify.webhook_handler.ShopifyWebhookHandler.verify_webhook_signature", return_value=True):
+        first = client.post("/webhooks/shopify/order-create", json=order_data, headers=headers)
+        second = client.post("/webhooks/shopify/order-create", json=order_data, headers=headers)
+    
+    assert first.status_code == 200
+    assert first.json()["status"] == "skipped"
+    assert second.status_code == 200
+    assert second.json()["status"] == "duplicate"
+    mock_process.assert_not_called()
+
+
+def test_metrics_endpoint(client):
+    """Test Prometheus metrics endpoint exposes request counters."""
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'fulfillment_requests_total{endpoint="/health",method="GET"}' in response.text
+
+
+@patch("fulfillment.main.process_order_fulfillment")
+def test_webhook_handler_invalid_signature(mock_process, client):
+    """Test that a bad signature is rejected with 401, not a 500."""
+    with patch("fulfillment.shopify.webhook_handler.ShopifyWebhookHandler.verify_webhook_signature", return_value=False):
+        response = client.post(
+            "/webhooks/shopify/order-create",
+            json={"id": 1},
+            headers={"Content-Type": "application/json"}
+        )
+    
+    assert response.status_code == 401
+    mock_process.assert_not_called()
+
+
+@patch("fulfillment.main.process_order_fulfillment")
+def test_webhook_handler_payload_too_large(mock_process, client):
+    """Test that payloads over the configured limit are rejected with 413."""
+    webhook_handler = client.app.state.webhook_handler
+    original_limit = webhook_handler.max_body_bytes
+    webhook_handler.max_body_bytes = 16
+    try:
+        response = client.post(
+            "/webhooks/shopify/order-create",
+            json={"id": 1, "note": "x" * 64},
+            headers={"Content-Type": "application/json"}
+        )
+    finally:
+        webhook_handler.max_body_bytes = original_limit
+    
+    assert response.status_code == 413
+    mock_process.assert_not_called()
+
+
+@patch("fulfillment.main.process_order_fulfillment")
+def test_webhook_handler_queue_full(mock_process, client):
+    """Test that a full order queue answers 503 so Shopify redelivers later."""
+    order_data = {
+        "id": 12346,
+        "order_number": "GL-1002",
+        "name": "#GL-1002",
+        "total_price": "29.99",
+        "currency": "USD",
+        "financial_status": "paid",
+        "created_at": "2024-01-15T10:30:00Z",
+        "updated_at": "2024-01-15T10:30:00Z",
+        "shipping_address": {"address1": "123 Main St", "zip": "90210"},
+        "line_items": [{"name": "Code Breakers Book Set", "quantity": 1}]
+    }
+    full_queue = asyncio.Queue(maxsize=1)
+    full_queue.put_nowait(None)
+    original_queue = client.app.state.order_queue
+    client.app.state.order_queue = full_queue
+    try:
+        with patch("fulfillment.shopify.webhook_handler.ShopifyWebhookHandler.verify_webhook_signature", return_value=True):
+            response = client.post(
+                "/webhooks/shopify/order-create",
+                json=order_data,
+                headers={"Content-Type": "application/json", "X-Shopify-Webhook-Id": "queue-full-1"}
+            )
+            # The claim was released, so the redelivery is not treated as a duplicate
+            retry = client.post(
+                "/webhooks/shopify/order-create",
+                json=order_data,
+                headers={"Content-Type": "application/json", "X-Shopify-Webhook-Id": "queue-full-1"}
+            )
+    finally:
+        client.app.state.order_queue = original_queue
+    
+    assert response.status_code == 503
+    assert retry.status_code == 503
+    assert not (ORDERS_DIR / "order_12346.json").exists()
+
+
+def test_test_order_webhook_rejects_invalid_order(client):
+    """Test that the test endpoint reports validation errors as 422."""
+    response = client.post("/test/order-webhook", content=b'{"id": "not-a-number"}')
+    assert response.status_code == 422
+
+
+def test_test_order_webhook_rejects_malformed_json(client):
+    """Test that a body that isn't JSON is a 400, not a 500."""
+    response = client.post("/test/order-webhook", content=b"not json")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid JSON payload"
+
+
+def test_log_lines_are_formatted_once():
+    """Test that queued records reach the stream handler unformatted."""
+    record = logging.LogRecord("fulfillment.main", logging.INFO, __file__, 1, "format check", None, None)
+
+    line = log_stream_handler.format(log_queue_handler.prepare(record))
+
+    assert line.endswith(" - fulfillment.main - INFO - format check")
+    assert "INFO:fulfillment.main" not in line
+
+
+def test_queue_handler_attached_only_during_lifespan():
+    """Test that the root logger has one QueueHandler while running and none after."""
+    def queue_handlers():
+        return [h for h in logging.getLogger().handlers if isinstance(h, QueueHandler)]
+
+    with TestClient(app):
+        assert queue_handlers() == [log_queue_handler]
+
+    assert queue_handlers() == []
+
+
+@patch("fulfillment.main.process_order_fulfillment")
+def test_webhook_handler_unsigned_request_does_not_claim_id(mock_process, client):
+    """Test that a rejected signature leaves the delivery id for the genuine webhook."""
+    order_data = {
+        "id": 12347,
+        "order_number": "GL-1003",
+        "name": "#GL-1003",
+        "total_price": "0.00",
+        "currency": "USD",
+        "financial_status": "pending",
+        "created_at": "2024-01-15T10:30:00Z",
+        "updated_at": "2024-01-15T10:30:00Z"
+    }
+    headers = {"X-Shopify-Webhook-Id": "unsigned-claim-1"}
+    handler_path = "fulfillment.shopify.webhook_handler.ShopifyWebhookHandler"
+    
+    with patch(f"{handler_path}.verify_webhook_signature", return_value=False), \
+            patch(f"{handler_path}.claim_delivery") as mock_claim:
+        forged = client.post("/webhooks/shopify/order-create", json=order_data, headers=headers)
+    with patch(f"{handler_path}.verify_webhook_signature", return_value=True):
+        genuine = client.post("/webhooks/shopify/order-create", json=order_data, headers=headers)
+    
+    assert forged.status_code == 401
+    mock_claim.assert_not_called()
+    assert genuine.json()["status"] == "skipped"
+
+
+def test_process_order_fulfillment_reports_purchased_rate(client):
+    """Test that Shopify gets the carrier of the rate actually bought."""
+    order = ShopifyOrder(
+        id=12348,
+        order_number="GL-1004",
+        name="#GL-1004",
+        total_price="29.99",
+        currency="USD",
+        financial_status="paid",
+        created_at="2024-01-15T10:30:00Z",
+        updated_at="2024-01-15T10:30:00Z",
+        shipping_address={"name": "Ada Lovelace", "address1": "1 Main St", "city": "Anytown",
+                          "province_code": "CA", "zip": "90210"},
+        line_items=[{"grams": 500, "quantity": 1}]
+    )
+    shippo_service = AsyncMock()
+    shippo_service.shop_rates.return_value = ({}, {"object_id": "rate-1", "provider": "UPS", "amount": "7.10"})
+    shippo_service.create_label_with_known_rate.return_value = ShippoLabelResponse(
+        object_id="txn-1", label_url="https://example.com/label.pdf",
+        tracking_number="1Z999", rate="rate-1", status="SUCCESS"
+    )
+    shopify_client = AsyncMock()
+    shopify_client.get_open_fulfillment_order.return_value = {"id": 55}
+    shopify_client.create_fulfillment.return_value = {"id": 77, "status": "success"}
+    
+    original = client.app.state.shippo_service, client.app.state.shopify_client
+    client.app.state.shippo_service, client.app.state.shopify_client = shippo_service, shopify_client
+    fulfillment_file = ORDERS_DIR / "fulfillment_12348.json"
+    try:
+        asyncio.run(process_order_fulfillment(order))
+        result = json.loads(fulfillment_file.read_text())
+    finally:
+        client.app.state.shippo_service, client.app.state.shopify_client = original
+        fulfillment_file.unlink(missing_ok=True)
+    
+    shippo_service.create_label_with_known_rate.assert_awaited_once_with({}, "rate-1")
+    assert shopify_client.create_fulfillment.await_args.kwargs["tracking_company"] == "UPS"
+    assert result["label"]["carrier"] == "UPS"
+    assert result["label"]["cost"] == "7.10"
+
+
+def test_process_order_fulfillment_records_label_when_lookup_fails(client):
+    """Test that a bought label is saved when the Shopify fulfillment order lookup fails."""
+    order = ShopifyOrder(
+        id=12349,
+        order_number="GL-1005",
+        name="#GL-1005",
+        total_price="29.99",
+        currency="USD",
+        financial_status="paid",
+        created_at="2024-01-15T10:30:00Z",
+        updated_at="2024-01-15T10:30:00Z",
+        shipping_address={"name": "Ada Lovelace", "address1": "1 Main St", "city": "Anytown",
+                          "province_code": "CA", "zip": "90210"},
+        line_items=[{"grams": 500, "quantity": 1}]
+    )
+    shippo_service = AsyncMock()
+    shippo_service.shop_rates.return_value = ({}, {"object_id": "rate-1", "provider": "UPS", "amount": "7.10"})
+    shippo_service.create_label_with_known_rate.return_value = ShippoLabelResponse(
+        object_id="txn-2", label_url="https://example.com/label.pdf",
+        tracking_number="1Z998", rate="rate-1", status="SUCCESS"
+    )
+    shopify_client = AsyncMock()
+    shopify_client.get_open_fulfillment_order.side_effect = ValueError("No open fulfillment order")
+    
+    original = client.app.state.shippo_service, client.app.state.shopify_client
+    client.app.state.shippo_service, client.app.state.shopify_client = shippo_service, shopify_client
+    label_file = ORDERS_DIR / "label_12349.json"
+    try:
+        asyncio.run(process_order_fulfillment(order))
+        label = json.loads(label_file.read_text())
+    finally:
+        client.app.state.shippo_service, client.app.state.shopify_client = original
+        label_file.unlink(missing_ok=True)
+    
+    shopify_client.create_fulfillment.assert_not_called()
+    assert label["transaction_id"] == "txn-2"
+    assert label["tracking_number"] == "1Z998"
+    assert label["rate"]["object_id"] == "rate-1"
+
+
+@patch("fulfillment.main.process_order_fulfillment")
+def test_webhook_handler_chunked_payload_too_large(mock_process, client):
+    """Test that a chunked body without Content-Length is still capped."""
+    webhook_handler = client.app.state.webhook_handler
+    original_limit = webhook_handler.max_body_bytes
+    webhook_handler.max_body_bytes = 16
+    try:
+        with patch("fulfillment.shopify.webhook_handler.ShopifyWebhookHandler.verify_webhook_signature", return_value=True):
+            response = client.post(
+                "/webhooks/shopify/order-create",
+                content=iter([b'{"id": 1, ', b'"note": "' + b"x" * 64 + b'"}']),
+                headers={"Content-Type": "application/json"}
+            )
+    finally:
+        webhook_handler.max_body_bytes = original_limit
+    
+    assert response.status_code == 413
+    mock_process.assert_not_called()
+
+
+@patch("fulfillment.main.process_order_fulfillment")
+def test_order_worker_finishes_order_before_sentinel(mock_process):
+    """Test that a worker stops between orders and leftovers can be drained."""
+    async def run():
+        queue = asyncio.Queue()
+        queue.put_nowait("first")
+        queue.put_nowait(None)
+        queue.put_nowait("second")
+        await order_worker(queue)
+        dropped = drain_order_queue(queue)
+        # Every item was marked done, so shutdown's join() would not hang
+        await asyncio.wait_for(queue.join(), timeout=1)
+        return dropped
+
+    dropped = asyncio.run(run())
+
+    mock_process.assert_awaited_once_with("first")
+    assert dropped == ["second"]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Unit tests for event idempotency claims."""
+from pathlib import Path
+import sys
+
+# Add fulfillment module to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import redis.asyncio as redis
+
+from fulfillment.utils.idempotency import IdempotencyStore
+
+
+async def test_claim_is_granted_once():
+    """Test that only the first claim for an event id succeeds."""
+    store = IdempotencyStore(ttl=60)
+
+    assert await store.claim("event-1") is True
+    assert await store.claim("event-1") is False
+    assert await store.claim("event-2") is True
+
+
+async def test_release_allows_reclaim():
+    """Test that a released claim can be taken again by a redelivery."""
+    store = IdempotencyStore(ttl=60)
+
+    await store.claim("event-1")
+    await store.release("event-1")
+
+    assert await store.claim("event-1") is True
+
+
+async def test_release_unknown_event_is_noop():
+    """Test that releasing an unclaimed id does not raise."""
+    store = IdempotencyStore(ttl=60)
+
+    await store.release("never-claimed")
+
+
+class UnreachableRedis:
+    """Stand-in client whose commands fail like a dropped connection."""
+
+    async def set(self, *args, **kwargs):
+        raise redis.ConnectionError("connection refused")
+
+    async def delete(self, *args, **kwargs):
+        raise redis.ConnectionError("connection refused")
+
+
+async def test_claim_falls_back_when_redis_unreachable():
+    """Test that Redis outages degrade to in-process dedup instead of failing."""
+    store = IdempotencyStore(ttl=60, redis_client=UnreachableRedis())
+
+    assert await store.claim("event-1") is True
+    assert await store.claim("event-1") is False
+    await store.release("event-1")
+    assert await store.claim("event-1") is True
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Unit tests for outbound rate limiting helpers."""
+import time
+import pytest
+from pathlib import Path
+import sys
+
+import httpx
+
+# Add fulfillment module to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from fulfillment.utils.ratelimit import AsyncLeakyBucket, CircuitBreaker, CircuitOpenError, is_non_retryable
+
+
+async def test_bucket_allows_burst_up_to_capacity():
+    """Test that requests within capacity are not delayed."""
+    bucket = AsyncLeakyBucket(rate=1.0, capacity=5)
+
+    start = time.monotonic()
+    for _ in range(5):
+        async with bucket:
+            pass
+
+    assert time.monotonic() - start < 0.1
+
+
+async def test_bucket_paces_requests_over_capacity():
+    """Test that a request past capacity waits for the bucket to leak."""
+    bucket = AsyncLeakyBucket(rate=20.0, capacity=1)
+
+    await bucket.acquire()
+    start = time.monotonic()
+    await bucket.acquire()
+
+    assert time.monotonic() - start >= 0.04
+
+
+async def test_bucket_sync_adopts_remote_usage():
+    """Test that reported usage fills the local bucket."""
+    bucket = AsyncLeakyBucket(rate=20.0, capacity=40)
+    bucket.sync(used=2, capacity=2)
+
+    start = time.monotonic()
+    await bucket.acquire()
+
+    assert bucket.capacity == 2
+    assert time.monotonic() - start >= 0.04
+
+
+@pytest.mark.parametrize("status_code,expected", [
+    (400, True),
+    (404, True),
+    (429, False),
+    (500, False),
+    (503, False),
+])
+def test_is_non_retryable(status_code, expected):
+    """Test that only server errors and throttling are retried."""
+    request = httpx.Request("GET", "https://example.com")
+    response = httpx.Response(status_code, request=request)
+    error = httpx.HTTPStatusError("error", request=request, response=response)
+
+    assert is_non_retryable(error) is expected
+    assert is_non_retryable(httpx.ConnectError("down")) is False
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    """Test that the breaker fails fast once the failure threshold is hit."""
+    breaker = CircuitBreaker("test", fail_max=2, reset_timeout=60.0)
+    request = httpx.Request("GET", "https://example.com")
+
+    breaker.record(httpx.Response(503, request=request))
+    breaker.check()
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_circuit_breaker_resets_on_success_and_timeout(monkeypatch):
+    """Test that successes clear failures and the circuit re-closes after the timeout."""
+    now = 100.0
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    breaker = CircuitBreaker("test", fail_max=2, reset_timeout=30.0)
+    request = httpx.Request("GET", "https://example.com")
+
+    breaker.record_failure()
+    breaker.record(httpx.Response(404, request=request))
+    breaker.record_failure()
+    breaker.check()  # the success reset the count, so one failure keeps it closed
+
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    now += 29.9
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    now += 0.1
+    breaker.check()  # reset_timeout elapsed, one call is let through
+
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()  # that call failed, so the circuit re-opened
+
+    breaker.record(httpx.Response(200, request=request))
+    breaker.check()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Unit tests for Shippo rate selection."""
+import pytest
+from pathlib import Path
+import sys
+
+# Add fulfillment module to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from fulfillment.shippo.client import ShippoService
+
+RATES = [
+    {"object_id": "ups-1", "amount": "5.00", "provider": "UPS", "messages": []},
+    {"object_id": "usps-1", "amount": "3.00", "provider": "USPS", "messages": []},
+    {"object_id": "usps-2", "amount": "1.00", "provider": "USPS", "messages": [{"text": "unavailable"}]},
+    {"object_id": "ups-2", "amount": "4.00", "provider": "UPS", "messages": []},
+]
+
+
+@pytest.fixture
+def service():
+    """Create a service for the pure rate-selection helpers."""
+    return ShippoService(api_token="shippo_test_token", test_mode=True)
+
+
+def test_select_best_rate_picks_cheapest_valid(service):
+    """Test that rates with messages are skipped and the cheapest wins."""
+    assert service._select_best_rate(RATES)["object_id"] == "usps-1"
+
+
+def test_select_best_rate_prefers_carrier(service):
+    """Test that the cheapest rate from the preferred carrier is chosen."""
+    assert service._select_best_rate(RATES, preferred_carrier="ups")["object_id"] == "ups-2"
+
+
+def test_select_best_rate_falls_back_when_carrier_missing(service):
+    """Test that an unavailable preferred carrier falls back to the cheapest rate."""
+    assert service._select_best_rate(RATES, preferred_carrier="fedex")["object_id"] == "usps-1"
+
+
+def test_select_best_rate_raises_without_valid_rates(service):
+    """Test that only invalid rates raise ValueError."""
+    with pytest.raises(ValueError):
+        service._select_best_rate([RATES[2]])
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Unit tests for the Shopify Admin API client."""
+import json
+import pytest
+from pathlib import Path
+import sys
+
+import httpx
+
+# Add fulfillment module to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from fulfillment.shopify.client import ShopifyClient
+
+
+def make_client(handler) -> ShopifyClient:
+    """Build a client backed by a mock transport."""
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return ShopifyClient(
+        shop_domain="test-shop.myshopify.com",
+        access_token="test-token",
+        api_version="2025-01",
+        http_client=http_client
+    )
+
+
+async def test_register_webhooks_single_graphql_request():
+    """Test that all topics are registered in one aliased mutation."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"data": {
+            "w0": {"webhookSubscription": {"id": "gid://1", "topic": "ORDERS_CREATE"}, "userErrors": []},
+            "w1": {"webhookSubscription": {"id": "gid://2", "topic": "ORDERS_UPDATED"}, "userErrors": []},
+        }})
+
+    client = make_client(handler)
+    webhooks = await client.register_webhooks(
+        ["orders/create", "orders/updated"],
+        "https://example.com/webhooks/shopify/order-create"
+    )
+
+    assert len(requests) == 1
+    assert requests[0].url.path == "/admin/api/2025-01/graphql.json"
+    assert requests[0].headers["X-Shopify-Access-Token"] == "test-token"
+    body = json.loads(requests[0].content)
+    assert "w0: webhookSubscriptionCreate(topic: ORDERS_CREATE" in body["query"]
+    assert "w1: webhookSubscriptionCreate(topic: ORDERS_UPDATED" in body["query"]
+    assert body["variables"]["subscription"]["callbackUrl"].endswith("/order-create")
+    assert [w["id"] for w in webhooks] == ["gid://1", "gid://2"]
+
+
+async def test_register_webhooks_raises_on_user_errors():
+    """Test that GraphQL user errors surface as ValueError."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"data": {
+            "w0": {"webhookSubscription": None, "userErrors": [{"field": ["callbackUrl"], "message": "taken"}]},
+        }})
+
+    client = make_client(handler)
+    with pytest.raises(ValueError):
+        await client.register_webhooks(["orders/create"], "https://example.com/hook")
+
+
+async def test_get_open_fulfillment_order_skips_closed():
+    """Test that the first open fulfillment order is returned."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"fulfillment_orders": [
+            {"id": 1, "status": "closed"},
+            {"id": 2, "status": "open"},
+        ]})
+
+    client = make_client(handler)
+    fulfillment_order = await client.get_open_fulfillment_order("1001")
+
+    assert fulfillment_order["id"] == 2
+
+
+async def test_get_open_fulfillment_order_raises_when_none_open():
+    """Test that an order with nothing open raises ValueError."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"fulfillment_orders": [{"id": 1, "status": "closed"}]})
+
+    client = make_client(handler)
+    with pytest.raises(ValueError):
+        await client.get_open_fulfillment_order("1001")
+
+
+async def test_nested_context_reuses_private_client():
+    """Test that only the outermost ``async with`` closes a private client."""
+    client = ShopifyClient(shop_domain="test-shop.myshopify.com", access_token="test-token")
+
+    async with client:
+        http_client = client.client
+        async with client:
+            assert client.client is http_client
+        assert not http_client.is_closed
+
+    assert http_client.is_closed
+
+
+async def test_register_webhooks_deletes_replaced_ids_in_same_request():
+    """Test that replaced webhooks are deleted ahead of the creates in one mutation."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"data": {
+            "d0": {"deletedWebhookSubscriptionId": "gid://shopify/WebhookSubscription/42", "userErrors": []},
+            "w0": {"webhookSubscription": {"id": "gid://1", "topic": "ORDERS_CREATE"}, "userErrors": []},
+        }})
+
+    client = make_client(handler)
+    webhooks = await client.register_webhooks(
+        ["orders/create"],
+        "https://example.com/webhooks/shopify/order-create",
+        replace_ids=[42]
+    )
+
+    assert len(requests) == 1
+    body = json.loads(requests[0].content)
+    assert body["query"].index("d0: webhookSubscriptionDelete") < body["query"].index("w0:")
+    assert body["variables"]["d0"] == "gid://shopify/WebhookSubscription/42"
+    assert [w["id"] for w in webhooks] == ["gid://1"]
+
+
+@pytest.fixture
+def no_backoff_sleep(monkeypatch):
+    """Skip the real waits between retries."""
+    async def sleep(seconds):
+        pass
+
+    monkeypatch.setattr("backoff._async.asyncio.sleep", sleep)
+
+
+@pytest.mark.parametrize("failure", [
+    httpx.Response(502),
+    httpx.ReadTimeout("slow"),
+])
+async def test_create_fulfillment_is_not_retried_after_it_may_have_landed(failure, no_backoff_sleep):
+    """Test that a POST is sent once when a 5xx or timeout leaves its outcome unknown."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if isinstance(failure, Exception):
+            raise failure
+        return failure
+
+    client = make_client(handler)
+    with pytest.raises(httpx.HTTPError):
+        await client.create_fulfillment("1Z999", "UPS", "55")
+
+    assert len(requests) == 1
+
+
+async def test_create_fulfillment_retries_after_429(no_backoff_sleep):
+    """Test that a rate-limited POST, which was never applied, is retried."""
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "0"}),
+        httpx.Response(201, json={"fulfillment": {"id": 77}}),
+    ]
+
+    client = make_client(lambda request: responses.pop(0))
+    fulfillment = await client.create_fulfillment("1Z999", "UPS", "55")
+
+    assert fulfillment["id"] == 77
+    assert responses == []
+
+
+async def test_get_order_retries_server_errors(no_backoff_sleep):
+    """Test that reads still retry on 5xx."""
+    responses = [httpx.Response(503), httpx.Response(200, json={"order": {"id": 1001}})]
+
+    client = make_client(lambda request: responses.pop(0))
+
+    assert (await client.get_order("1001"))["id"] == 1001
+    assert responses == []
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Unit tests for the Shopify webhook handler."""
+import base64
+import hashlib
+import hmac
+from pathlib import Path
+import sys
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+# Add fulfillment module to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from fulfillment.shopify.webhook_handler import ShopifyOrder, ShopifyWebhookHandler
+from fulfillment.utils.config import Settings
+
+SECRET = "test-webhook-secret"
+BODY = b'{"id": 1}'
+
+
+def make_request(signature: str) -> Request:
+    """Build a webhook request carrying ``BODY`` and the given HMAC header."""
+    async def receive():
+        return {"type": "http.request", "body": BODY, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/webhooks/shopify/order-create",
+        "headers": [(b"x-shopify-hmac-sha256", signature.encode("utf-8"))],
+    }
+    return Request(scope, receive)
+
+
+def make_handler() -> ShopifyWebhookHandler:
+    """Build a handler with a known webhook secret."""
+    return ShopifyWebhookHandler(Settings(shopify_webhook_secret=SECRET))
+
+
+def make_order(**overrides) -> ShopifyOrder:
+    """Build a paid order, overriding any fields a test cares about."""
+    fields = {
+        "id": 1,
+        "order_number": "1001",
+        "name": "#1001",
+        "total_price": "10.00",
+        "currency": "USD",
+        "financial_status": "paid",
+        "created_at": "2024-01-15T10:30:00Z",
+        "updated_at": "2024-01-15T10:30:00Z",
+    }
+    return ShopifyOrder(**{**fields, **overrides})
+
+
+async def test_verify_webhook_signature_accepts_valid_hmac():
+    """Test that Shopify's base64 HMAC of the raw body verifies."""
+    signature = base64.b64encode(
+        hmac.new(SECRET.encode(), BODY, hashlib.sha256).digest()
+    ).decode()
+
+    assert await make_handler().verify_webhook_signature(make_request(signature)) is True
+
+
+async def test_verify_webhook_signature_rejects_non_ascii_header():
+    """Test that a malformed header is a mismatch, not an exception."""
+    assert await make_handler().verify_webhook_signature(make_request("sïgnature")) is False
+
+
+def test_calculate_package_weight_sums_line_items():
+    """Test that grams times quantity are summed and converted to pounds."""
+    order = make_order(line_items=[
+        {"grams": 453.592, "quantity": 2},
+        {"grams": 226.796, "quantity": 1},
+    ])
+
+    assert make_handler().calculate_package_weight(order) == pytest.approx(2.5)
+
+
+def test_calculate_package_weight_has_one_pound_minimum():
+    """Test that light orders ship at the 1 lb minimum."""
+    order = make_order(line_items=[{"grams": 10, "quantity": 1}])
+
+    assert make_handler().calculate_package_weight(order) == 1.0
+
+
+async def test_verify_webhook_signature_rejects_malformed_base64():
+    """Test that a header that isn't base64 is rejected rather than raising."""
+    assert await make_handler().verify_webhook_signature(make_request("not*base64")) is False
+
+
+def test_extract_shipping_info_falls_back_to_first_and_last_name():
+    """Test that a missing name and province code use their fallbacks."""
+    order = make_order(shipping_address={"first_name": "Ada", "last_name": "Lovelace", "province": "California"})
+
+    info = make_handler().extract_shipping_info(order)
+
+    assert info["name"] == "Ada Lovelace"
+    assert info["state"] == "California"
+    assert info["country"] == "US"
+
+
+def test_extract_shipping_info_ignores_null_name_parts():
+    """Test that a null first or last name doesn't render as "None"."""
+    order = make_order(shipping_address={"first_name": None, "last_name": "Lovelace"})
+
+    assert make_handler().extract_shipping_info(order)["name"] == "Lovelace"
+
+
+async def test_verify_webhook_signature_rejects_wrong_length_before_reading_body():
+    """Test that a header of the wrong length is rejected without hashing the body."""
+    async def receive():
+        raise AssertionError("body should not be read")
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/webhooks/shopify/order-create",
+        "headers": [(b"x-shopify-hmac-sha256", base64.b64encode(b"short"))],
+    }
+
+    assert await make_handler().verify_webhook_signature(Request(scope, receive)) is False
+
+
+async def test_read_body_rejects_oversized_chunked_request():
+    """Test that the size cap holds without a Content-Length header."""
+    chunks = [b"x" * 10, b"x" * 10, b"x" * 10]
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/webhooks/shopify/order-create",
+        "headers": [(b"transfer-encoding", b"chunked")],
+    }
+    handler = make_handler()
+    handler.max_body_bytes = 16
+
+    with pytest.raises(HTTPException) as exc_info:
+        await handler.read_body(Request(scope, receive))
+
+    assert exc_info.value.status_code == 413
+    assert chunks == [b"x" * 10]